@@ -1,10 +1,12 @@
 import sys
 import os
 import threading
+import multiprocessing
 import tempfile
 import shutil
 import webbrowser
 import json
+import io
 import qtawesome as qta  # Requires: pip install qtawesome
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QPushButton, QLabel, QListWidget, 
@@ -12,14 +14,13 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QListWidgetItem, QAbstractItemView, QInputDialog, 
                              QLineEdit, QScrollArea, QComboBox, QRadioButton,
                              QButtonGroup, QMenu, QDialog, QGridLayout, QCheckBox, 
-                             QSizePolicy, QTextEdit, QToolButton, 
+                             QSizePolicy, QTextEdit, QToolButton, QDoubleSpinBox,
                              QStyleOption, QStyle)
 from PyQt6.QtCore import Qt, pyqtSignal, QObject, QSize, QSettings
 from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QIcon, QFont, QPixmap, QKeyEvent, QAction, QColor, QPainter
-from pdf2image import convert_from_path
 
 # Import backend engine
-from pdf_engine import PDFEngine
+from pdf_engine import PDFEngine, OutputOptions
 
 # --- UPDATED THEMES (Guaranteed Tile Borders) ---
 DARK_THEME = """
@@ -133,6 +134,18 @@ class AppState:
     def set_setting(cls, key, value):
         cls._settings.setValue(f"settings/{key}", value)
 
+    @classmethod
+    def load_output_options(cls):
+        """Pushes the saved output settings into the engine."""
+        try:
+            PDFEngine.output_options = OutputOptions(
+                cls.get_setting("output_linearize", "false") == "true",
+                cls.get_setting("output_object_streams", "preserve"),
+                cls.get_setting("output_compression", "default"))
+        except ValueError:
+            # A stale or hand-edited value should not stop the app from starting
+            PDFEngine.output_options = OutputOptions()
+
     @classmethod
     def log_usage(cls, tool_name, num_files=1):
         """Increments usage stats for the dashboard."""
@@ -335,7 +348,7 @@ class OrganizerGrid(QListWidget):
         item.setIcon(QIcon(transform))
 
 from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsEllipseItem
-from PyQt6.QtGui import QPen, QBrush, QPainter
+from PyQt6.QtGui import QPen, QBrush, QPainter, QImageReader, QImageIOHandler
 
 class DraggableScanDialog(QDialog):
     def __init__(self, image_path):
@@ -344,6 +357,7 @@ class DraggableScanDialog(QDialog):
         self.resize(1000, 650)
         self.image_path = image_path
         self.scale_factor = 1.0
+        self.decoded = None  # full-resolution decode from the background worker, reused by the warp
         
         main_layout = QVBoxLayout(self)
         
@@ -357,17 +371,17 @@ class DraggableScanDialog(QDialog):
         self.view.setRenderHint(QPainter.RenderHint.Antialiasing)
         self.view.setStyleSheet("background: #181825; border: 2px solid #45475a; border-radius: 8px;")
         
-        self.pixmap = QPixmap(image_path)
+        # Decode straight at display size: a 48 MP photo is never loaded in full here
+        reader = QImageReader(image_path)
+        reader.setAutoTransform(True)
+        raw_size = reader.size()
+        rotated = bool(reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90)
+        img_w, img_h = (raw_size.height(), raw_size.width()) if rotated else (raw_size.width(), raw_size.height())
         view_w, view_h = 950, 500
-        img_w, img_h = self.pixmap.width(), self.pixmap.height()
         self.scale_factor = min(view_w / img_w, view_h / img_h)
-        
-        scaled_pix = self.pixmap.scaled(
-            int(img_w * self.scale_factor), 
-            int(img_h * self.scale_factor), 
-            Qt.AspectRatioMode.KeepAspectRatio, 
-            Qt.TransformationMode.SmoothTransformation
-        )
+        reader.setScaledSize(QSize(int(raw_size.width() * self.scale_factor), int(raw_size.height() * self.scale_factor)))
+        scaled_pix = QPixmap.fromImage(reader.read())
+        self.scale_factor = scaled_pix.width() / img_w
         
         self.scene_img = QGraphicsPixmapItem(scaled_pix)
         self.scene.addItem(self.scene_img)
@@ -384,6 +398,7 @@ class DraggableScanDialog(QDialog):
             handle = self.create_handle(x, y)
             self.handles.append(handle)
             self.scene.addItem(handle)
+        self.default_positions = [h.pos() for h in self.handles]
 
         btn_layout = QHBoxLayout()
         btn_cancel = QPushButton("Cancel")
@@ -398,6 +413,18 @@ class DraggableScanDialog(QDialog):
         btn_layout.addWidget(btn_apply)
         main_layout.addLayout(btn_layout)
 
+        # Decode and detect the document in the background; handles move once corners are found
+        self.detect_worker = TaskWorker(PDFEngine.prepare_scan, image_path)
+        self.detect_worker.signals.result_data.connect(self.on_detected)
+        self.detect_worker.start()
+
+    def on_detected(self, result):
+        self.decoded, corners = result
+        # Never override handles the user has already dragged
+        if corners is None or [h.pos() for h in self.handles] != self.default_positions: return
+        for handle, (x, y) in zip(self.handles, corners):
+            handle.setPos(x * self.scale_factor - 10, y * self.scale_factor - 10)
+
     def create_handle(self, x, y):
         size = 20
         ellipse = QGraphicsEllipseItem(0, 0, size, size)
@@ -657,6 +684,9 @@ class DashboardPage(QWidget):
 # --- PAGE CLASSES ---
 
 class SettingsPage(QWidget):
+    OBJECT_STREAMS = [("Keep as is", "preserve"), ("Generate (smaller files)", "generate"), ("Disable (old readers)", "disable")]
+    COMPRESSION = [("Default", "default"), ("Maximum", "max"), ("None (debugging)", "none")]
+
     def __init__(self):
         super().__init__()
         layout = QVBoxLayout(self)
@@ -685,6 +715,23 @@ class SettingsPage(QWidget):
         self.chk_open = QCheckBox("Automatically open files after processing")
         self.chk_open.setChecked(AppState.get_setting("auto_open", "false") == "true")
         form_layout.addWidget(self.chk_open, 1, 0, 1, 2)
+
+        # Output options, applied to every PDF the tools write
+        self.chk_linearize = QCheckBox("Fast web view (linearize PDFs so page 1 shows while downloading)")
+        self.chk_linearize.setChecked(AppState.get_setting("output_linearize", "false") == "true")
+        form_layout.addWidget(self.chk_linearize, 2, 0, 1, 2)
+
+        self.combo_objstm = QComboBox()
+        self.combo_objstm.addItems([label for label, _ in self.OBJECT_STREAMS])
+        self.combo_objstm.setCurrentIndex([v for _, v in self.OBJECT_STREAMS].index(PDFEngine.output_options.object_streams))
+        form_layout.addWidget(QLabel("Object Streams:"), 3, 0)
+        form_layout.addWidget(self.combo_objstm, 3, 1)
+
+        self.combo_compression = QComboBox()
+        self.combo_compression.addItems([label for label, _ in self.COMPRESSION])
+        self.combo_compression.setCurrentIndex([v for _, v in self.COMPRESSION].index(PDFEngine.output_options.compression))
+        form_layout.addWidget(QLabel("Stream Compression:"), 4, 0)
+        form_layout.addWidget(self.combo_compression, 4, 1)
         
         layout.addLayout(form_layout)
         
@@ -702,6 +749,10 @@ class SettingsPage(QWidget):
     def save_settings(self):
         AppState.set_setting("default_dir", self.inp_dir.text())
         AppState.set_setting("auto_open", "true" if self.chk_open.isChecked() else "false")
+        AppState.set_setting("output_linearize", "true" if self.chk_linearize.isChecked() else "false")
+        AppState.set_setting("output_object_streams", self.OBJECT_STREAMS[self.combo_objstm.currentIndex()][1])
+        AppState.set_setting("output_compression", self.COMPRESSION[self.combo_compression.currentIndex()][1])
+        AppState.load_output_options()
         QMessageBox.information(self, "Saved", "Settings saved successfully!")
         
 class WorkflowPage(BaseToolPage):
@@ -723,8 +774,11 @@ class WorkflowPage(BaseToolPage):
             ("Compress (Low)", "fa5s.compress-arrows-alt"),
             ("Compress (Medium)", "fa5s.compress-arrows-alt"),
             ("Compress (Extreme)", "fa5s.compress"),
+            ("Compress (Scanned)", "fa5s.file-image"),
             ("Extract Images", "fa5s.images"),
+            ("Clean Scan (Deskew)", "fa5s.magic"),
             ("OCR (Searchable PDF)", "fa5s.search"),
+            ("OCR (Scanned Pages Only)", "fa5s.search-plus"),
             ("Add Page Numbers", "fa5s.list-ol"),
             ("Watermark (Draft)", "fa5s.stamp"),
             ("Clear Metadata", "fa5s.eraser")
@@ -794,37 +848,45 @@ class WorkflowPage(BaseToolPage):
             self.run_worker(self.execute_pipeline, files[0], save_path, steps)
 
     def execute_pipeline(self, input_file, final_output, steps):
-        current_in = input_file
         temp_files = []
-        
         try:
-            for i, step_name in enumerate(steps):
-                is_last = (i == len(steps) - 1)
-                current_out = final_output if is_last else tempfile.mktemp(suffix=".pdf")
-                if not is_last: temp_files.append(current_out)
-                
-                # Route step to proper PDFEngine function
-                if step_name == "Grayscale": PDFEngine.convert_grayscale(current_in, current_out)
-                elif step_name == "Flatten": PDFEngine.flatten_pdf(current_in, current_out)
-                elif step_name == "Compress (Low)": PDFEngine.compress_pdf(current_in, current_out, "low")
-                elif step_name == "Compress (Medium)": PDFEngine.compress_pdf(current_in, current_out, "medium")
-                elif step_name == "Compress (Extreme)": PDFEngine.compress_pdf(current_in, current_out, "extreme")
-                elif step_name == "OCR (Searchable PDF)": PDFEngine.ocr_pdf(current_in, current_out)
-                elif step_name == "Add Page Numbers": PDFEngine.add_page_numbers(current_in, current_out, "bottom-center")
-                elif step_name == "Watermark (Draft)": PDFEngine.add_watermark(current_in, current_out, "DRAFT")
-                elif step_name == "Clear Metadata": PDFEngine.update_metadata(current_in, current_out, {})
-                elif step_name == "Extract Images": 
-                    PDFEngine.extract_images(current_in, os.path.dirname(final_output))
-                    if not is_last: shutil.copy(current_in, current_out)
-                else:
-                    if not is_last: shutil.copy(current_in, current_out)
-                    
-                current_in = current_out
+            # Intermediate files stay as written; output options apply to the result only
+            with PDFEngine.deferred_output_options():
+                self.run_steps(input_file, final_output, steps, temp_files)
+            PDFEngine.apply_output_options(final_output)
         finally:
             for f in temp_files:
                 try: os.remove(f)
                 except: pass
-                                
+
+    def run_steps(self, input_file, final_output, steps, temp_files):
+        current_in = input_file
+        for i, step_name in enumerate(steps):
+            is_last = (i == len(steps) - 1)
+            current_out = final_output if is_last else tempfile.mktemp(suffix=".pdf")
+            if not is_last: temp_files.append(current_out)
+            
+            # Route step to proper PDFEngine function
+            if step_name == "Grayscale": PDFEngine.convert_grayscale(current_in, current_out)
+            elif step_name == "Flatten": PDFEngine.flatten_pdf(current_in, current_out)
+            elif step_name == "Compress (Low)": PDFEngine.compress_pdf(current_in, current_out, "low")
+            elif step_name == "Compress (Medium)": PDFEngine.compress_pdf(current_in, current_out, "medium")
+            elif step_name == "Compress (Extreme)": PDFEngine.compress_pdf(current_in, current_out, "extreme")
+            elif step_name == "Compress (Scanned)": PDFEngine.compress_pdf(current_in, current_out, "scanned")
+            elif step_name == "Clean Scan (Deskew)": PDFEngine.clean_scan(current_in, current_out)
+            elif step_name == "OCR (Searchable PDF)": PDFEngine.ocr_pdf(current_in, current_out)
+            elif step_name == "OCR (Scanned Pages Only)": PDFEngine.ocr_pdf(current_in, current_out, mode="overlay")
+            elif step_name == "Add Page Numbers": PDFEngine.add_page_numbers(current_in, current_out, "bottom-center")
+            elif step_name == "Watermark (Draft)": PDFEngine.add_watermark(current_in, current_out, "DRAFT")
+            elif step_name == "Clear Metadata": PDFEngine.clear_metadata(current_in, current_out)
+            elif step_name == "Extract Images": 
+                PDFEngine.extract_images(current_in, os.path.dirname(final_output))
+                if not is_last: shutil.copy(current_in, current_out)
+            else:
+                if not is_last: shutil.copy(current_in, current_out)
+                
+            current_in = current_out
+
 class HtmlToPdfPage(BaseToolPage):
     def __init__(self):
         super().__init__("HTML to PDF (Pro)", "Render modern HTML/CSS with emoji support.", "Convert to PDF")
@@ -905,12 +967,16 @@ class FlattenPdfPage(BaseToolPage):
 class GrayscalePdfPage(BaseToolPage):
     def __init__(self):
         super().__init__("Grayscale PDF", "Convert colorful PDFs to Black & White.", "Convert to B&W")
+        self.combo = QComboBox()
+        self.combo.addItems(["Keep Text & Vectors", "Rasterize Pages"])
+        self.ctl_layout.addWidget(self.combo)
         self.btn_process.clicked.connect(self.action)
     def action(self):
         files = self.get_files() # FIX
         if not files: return
+        mode = "raster" if self.combo.currentIndex() == 1 else "vector"
         dest, _ = QFileDialog.getSaveFileName(self, "Save File", "grayscale.pdf", "PDF (*.pdf)")
-        if dest: self.run_worker(PDFEngine.convert_grayscale, files[0], dest)
+        if dest: self.run_worker(PDFEngine.convert_grayscale, files[0], dest, mode=mode)
 
 class ImgToPdfPage(BaseToolPage):
     def __init__(self):
@@ -921,21 +987,68 @@ class ImgToPdfPage(BaseToolPage):
         self.btn_smart.setStyleSheet("background-color: #f38ba8; color: #181825; border: none; font-weight: bold;")
         self.btn_smart.clicked.connect(self.smart_scan_dialog)
         self.ctl_layout.insertWidget(1, self.btn_smart)
+        self.btn_batch = QPushButton(" Batch Scan")
+        self.btn_batch.setIcon(qta.icon('fa5s.copy', color="#cdd6f4"))
+        self.btn_batch.setProperty("class", "upload-btn")
+        self.btn_batch.clicked.connect(self.batch_scan)
+        self.ctl_layout.insertWidget(2, self.btn_batch)
+        self.scan_dir = None
         self.btn_process.clicked.connect(self.action)
 
+    def add_scanned(self, source, data):
+        """The item carries the warped JPEG (bytes, or the file a batch scan wrote) instead of the photo."""
+        item = QListWidgetItem(f"{os.path.basename(source)} (scanned)")
+        item.setToolTip(f"Scanned from {source}")
+        item.setData(Qt.ItemDataRole.UserRole, data)
+        item.setIcon(qta.icon('fa5s.file-image', color="#89b4fa"))
+        self.file_list.addItem(item)
+
+    def manual_scan(self, file):
+        """Shows the corner dialog; returns a warp job (file, corners, decoded image) or None."""
+        dlg = DraggableScanDialog(file)
+        return (file, dlg.final_corners, dlg.decoded) if dlg.exec() else None
+
+    def warp_scans(self, jobs):
+        """Worker thread: warps each job, reusing the dialog's decode when it finished in time."""
+        results = []
+        for file, corners, decoded in jobs:
+            buf = io.BytesIO()
+            PDFEngine.manual_scan_warp(file, corners, image=decoded).save(buf, "JPEG", quality=92)
+            results.append((file, buf.getvalue()))
+        return results
+
+    def add_warped(self, results):
+        for file, data in results: self.add_scanned(file, data)
+
     def smart_scan_dialog(self):
         file, _ = QFileDialog.getOpenFileName(self, "Select Image", "", "Images (*.jpg *.jpeg *.png)")
         if not file: return
-        dlg = DraggableScanDialog(file)
-        if dlg.exec():
-            try:
-                processed_img = PDFEngine.manual_scan_warp(file, dlg.final_corners)
-                fd, path = tempfile.mkstemp(suffix=".jpg")
-                os.close(fd)
-                processed_img.save(path)
-                self.file_list.addItems([path])
-            except Exception as e:
-                QMessageBox.warning(self, "Error", str(e))
+        job = self.manual_scan(file)
+        if job: self.run_worker(self.warp_scans, [job], success_callback=self.add_warped)
+
+    def batch_scan(self):
+        files, _ = QFileDialog.getOpenFileNames(self, "Select Photos", "", "Images (*.jpg *.jpeg *.png)")
+        if not files: return
+        # Batch scans go to files kept until the page is destroyed, not into memory
+        if self.scan_dir is None: self.scan_dir = tempfile.TemporaryDirectory(prefix="scans_")
+        self.run_worker(PDFEngine.batch_auto_scan, files, self.scan_dir.name, success_callback=self.review_batch)
+
+    def review_batch(self, results):
+        flagged = [r["source"] for r in results if r["flagged"]]
+        for r in results:
+            if not r["flagged"]: self.add_scanned(r["source"], r["image"])
+        self.lbl_status.setText(f"Scanned {len(results) - len(flagged)} photos, {len(flagged)} need review.")
+        if not flagged: return
+        answer = QMessageBox.question(self, "Review Needed",
+                                      f"No document edges were found in {len(flagged)} photo(s). Set their corners now?\n"
+                                      "Photos you skip are added uncropped.")
+        jobs = []
+        for file in flagged:
+            job = self.manual_scan(file) if answer == QMessageBox.StandardButton.Yes else None
+            # Cancelling the dialog keeps the photo as it is rather than dropping it
+            if job: jobs.append(job)
+            else: self.file_list.addItems([file])
+        if jobs: self.run_worker(self.warp_scans, jobs, success_callback=self.add_warped)
 
     def action(self):
         files = self.get_files()
@@ -946,13 +1059,33 @@ class ImgToPdfPage(BaseToolPage):
 class OCRPage(BaseToolPage):
     def __init__(self):
         super().__init__("OCR (Searchable PDF)", "Make scanned documents searchable.", "Run OCR")
+        self.combo_mode = QComboBox()
+        self.combo_mode.addItems(["Scanned Pages Only (Keep Original)", "Rebuild All Pages"])
+        self.ctl_layout.addWidget(self.combo_mode)
+        self.combo_workers = QComboBox()
+        self.combo_workers.addItems(["All Cores"] + [f"{n} Cores" for n in (1, 2, 4, 8, 16) if n <= (os.cpu_count() or 1)])
+        self.ctl_layout.addWidget(self.combo_workers)
+        self.chk_clean = QCheckBox()
+        self.ctl_layout.addWidget(self.chk_clean)
+        # Overlay mode keeps the original page, so only binarizing can happen without moving the words
+        self.combo_mode.currentIndexChanged.connect(self.update_clean_label)
+        self.update_clean_label()
         self.btn_process.clicked.connect(self.action)
+
+    def update_clean_label(self):
+        if self.combo_mode.currentIndex() == 0:
+            self.chk_clean.setText("Clean up scans before OCR (binarize only)")
+        else:
+            self.chk_clean.setText("Clean up scans (rotate, deskew, binarize, crop)")
     
     def action(self):
         files = self.get_files()
         if not files: return
+        mode = ["overlay", "replace"][self.combo_mode.currentIndex()]
+        choice = self.combo_workers.currentText().split()[0]
+        workers = int(choice) if choice.isdigit() else None
         save_path, _ = QFileDialog.getSaveFileName(self, "Save", "ocr.pdf", "PDF (*.pdf)")
-        if save_path: self.run_worker(PDFEngine.ocr_pdf, files[0], save_path)
+        if save_path: self.run_worker(PDFEngine.ocr_pdf, files[0], save_path, workers=workers, mode=mode, preprocess=self.chk_clean.isChecked())
 
 class WatermarkPage(BaseToolPage):
     def __init__(self):
@@ -1020,7 +1153,8 @@ class MetadataPage(BaseToolPage):
     def action(self):
         files = self.get_files()
         if not files: return
-        new_meta = {key: inp.text() for key, inp in self.inputs.items() if inp.text()}
+        # Emptied fields are passed too: ones the file has are cleared, the rest ignored
+        new_meta = {key: inp.text() for key, inp in self.inputs.items()}
         save_path, _ = QFileDialog.getSaveFileName(self, "Save", "meta.pdf", "PDF")
         if save_path: self.run_worker(PDFEngine.update_metadata, files[0], save_path, new_meta)
 
@@ -1058,31 +1192,128 @@ class OrganizePage(BaseToolPage):
         if save: self.run_worker(PDFEngine.reorder_save_pdf, self.curr, save, data)
 
 class SplitPage(BaseToolPage):
+    # (label, engine mode, what the value field asks for)
+    MODES = [("One File per Page", "all", None),
+             ("Extract Range", "extract", "Pages, e.g. 1-3, 7, 10-"),
+             ("Every N Pages", "every_n", "Pages per file"),
+             ("Max Size (MB)", "size", "MB per file"),
+             ("Top-level Bookmarks", "bookmarks", None)]
+
     def __init__(self):
         super().__init__("Split PDF", "Split or Extract.")
         self.file_list.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.combo = QComboBox()
+        self.combo.addItems([label for label, _, _ in self.MODES])
+        self.ctl_layout.addWidget(self.combo)
+        self.inp_value = QLineEdit()
+        self.inp_value.setVisible(False)
+        self.ctl_layout.addWidget(self.inp_value)
+        self.combo.currentIndexChanged.connect(self.update_value_field)
         self.btn_process.clicked.connect(self.action)
-    
+
+    def update_value_field(self, index):
+        hint = self.MODES[index][2]
+        self.inp_value.setVisible(hint is not None)
+        self.inp_value.clear()
+        self.inp_value.setPlaceholderText(hint or "")
+
     def action(self):
         files = self.get_files()
         if not files: return
+        _, mode, _ = self.MODES[self.combo.currentIndex()]
+        value = self.inp_value.text().strip()
+        kwargs = {}
+        try:
+            if mode == "extract":
+                if not value: return QMessageBox.warning(self, "Input Required", "Enter the pages to extract.")
+                kwargs["page_range"] = value
+            elif mode == "every_n":
+                kwargs["pages_per_part"] = int(value)
+            elif mode == "size":
+                kwargs["max_bytes"] = int(float(value) * 1024 * 1024)
+        except ValueError:
+            return QMessageBox.warning(self, "Input Required", "Enter a number.")
         dest = QFileDialog.getExistingDirectory(self, "Select Output Folder")
-        if dest: self.run_worker(PDFEngine.split_pdf, files[0], dest, "all", None)
+        if dest: self.run_worker(PDFEngine.split_pdf, files[0], dest, mode, **kwargs)
 
 class CompressPage(BaseToolPage):
+    LEVELS = ["low", "medium", "extreme", "scanned"]
+
     def __init__(self):
         super().__init__("Compress PDF", "Reduce size.")
         self.combo = QComboBox()
-        self.combo.addItems(["Low", "Medium", "Extreme"])
+        self.combo.addItems(["Low", "Medium", "Extreme", "Scanned", "Target Size"])
         self.ctl_layout.addWidget(self.combo)
+
+        # Only used by "Target Size": the limit the output must fit under
+        self.spin_target = QDoubleSpinBox()
+        self.spin_target.setRange(0.1, 2000.0)
+        self.spin_target.setDecimals(1)
+        self.spin_target.setValue(float(AppState.get_setting("compress_target_mb", 10.0)))
+        self.spin_target.setSuffix(" MB")
+        self.spin_target.setVisible(False)
+        self.ctl_layout.addWidget(self.spin_target)
+        self.combo.currentIndexChanged.connect(lambda i: self.spin_target.setVisible(i == len(self.LEVELS)))
+
+        self.btn_analyze = QPushButton(" Analyze")
+        self.btn_analyze.setIcon(qta.icon('fa5s.chart-pie', color="#cdd6f4"))
+        self.btn_analyze.setProperty("class", "upload-btn")
+        self.btn_analyze.clicked.connect(self.analyze)
+        self.ctl_layout.addWidget(self.btn_analyze)
+
+        # Dry-run report: where the bytes are and what each level should produce
+        self.lbl_analysis = QLabel("Select a file and click Analyze to see where the bytes are.")
+        self.lbl_analysis.setStyleSheet("color: #a6adc8; font-size: 13px;")
+        self.lbl_analysis.setWordWrap(True)
+        self.layout().insertWidget(4, self.lbl_analysis)
+        self.analysis_worker = None
         self.btn_process.clicked.connect(self.action)
 
+    def analyze(self):
+        files = self.get_files()
+        if not files: return
+        self.btn_analyze.setEnabled(False)
+        self.lbl_analysis.setText("Analyzing...")
+        # Not run_worker: a dry run should not touch the process button or usage stats
+        self.analysis_worker = TaskWorker(PDFEngine.analyze_pdf, files[0])
+        self.analysis_worker.signals.result_data.connect(self.show_analysis)
+        self.analysis_worker.signals.error.connect(self.show_analysis_error)
+        self.analysis_worker.start()
+
+    def show_analysis(self, report):
+        mb = lambda n: f"{n / (1024 * 1024):.2f} MB"
+        total = max(1, report["file_size"])
+        lines = [f"<b>{mb(report['file_size'])}</b> &middot; {report['pages']} pages &middot; {report['objects']} objects"]
+        lines += [f"{name}: {mb(size)} ({100 * size / total:.0f}%)" for name, size in report["categories"].items() if size]
+        est = report["estimates"]
+        lines.append("<b>Estimated output:</b> " + " &middot; ".join(
+            f"{label} {mb(max(0, est[level]))}" for label, level in zip(["Low", "Medium", "Extreme", "Scanned"], self.LEVELS)))
+        self.lbl_analysis.setText("<br>".join(lines))
+        self.btn_analyze.setEnabled(True)
+
+    def show_analysis_error(self, err):
+        self.lbl_analysis.setText(f"Analysis failed: {err}")
+        self.btn_analyze.setEnabled(True)
+
     def action(self):
         files = self.get_files()
         if not files: return
-        level = ["low","medium","extreme"][self.combo.currentIndex()]
         save_path, _ = QFileDialog.getSaveFileName(self, "Save", "c.pdf", "PDF (*.pdf)")
-        if save_path: self.run_worker(PDFEngine.compress_pdf, files[0], save_path, level)
+        if not save_path: return
+        if self.combo.currentIndex() == len(self.LEVELS):
+            mb = self.spin_target.value()
+            AppState.set_setting("compress_target_mb", mb)
+            self.run_worker(PDFEngine.compress_to_size, files[0], save_path, int(mb * 1024 * 1024),
+                            success_callback=self.show_target_result)
+        else:
+            self.run_worker(PDFEngine.compress_pdf, files[0], save_path, self.LEVELS[self.combo.currentIndex()])
+
+    def show_target_result(self, result):
+        size = f"{result['size'] / (1024 * 1024):.2f} MB"
+        if result["dpi"] is None:
+            self.lbl_status.setText(f"Success! {size} (no image downsampling needed)")
+        else:
+            self.lbl_status.setText(f"Success! {size} (images at {result['dpi']} dpi, quality {result['quality']})")
 
 class ProtectPage(BaseToolPage):
     def __init__(self):
@@ -1353,7 +1584,10 @@ class MainWindow(QMainWindow):
             self.btns[idx].click()
 
 if __name__ == "__main__":
+    # Required for process pools in a frozen (PyInstaller) build
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
+    AppState.load_output_options()
     window = MainWindow()
     window.show()
     sys.exit(app.exec())
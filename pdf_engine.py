@@ -1,14 +1,27 @@
 import os
 import io
-import img2pdf
+import json
+import inspect
+import contextlib
+import functools
+import zlib
+import struct
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque, namedtuple
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
 import cv2
 import pytesseract
 from pypdf import PdfReader, PdfWriter
 from pdf2docx import Converter
-from pdf2image import convert_from_path
 from docx2pdf import convert as docx_convert
-from PIL import Image
+from PIL import Image, ImageOps
 import fitz
 import comtypes.client
 from pptx import Presentation
@@ -19,104 +32,2628 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 from playwright.sync_api import sync_playwright
 
+# Optional: tesserocr binds the Tesseract C API, so a worker can keep one model
+# loaded for its whole life instead of spawning tesseract.exe for every page.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
 # Set Tesseract Path (Windows default or generic)
 # Users must install Tesseract-OCR and add to PATH, or set it here:
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
+# --- PARALLEL WORKERS ---
+# Pool workers must be module-level functions so ProcessPoolExecutor can pickle them.
+# Per-process state (open documents, settings) is stashed here by the initializers.
+_WORKER_STATE = {}
+
+def _worker_count(workers=None, jobs=None):
+    """Resolves a pool size: explicit value, else one worker per core, never more than jobs."""
+    count = workers or os.cpu_count() or 1
+    if jobs is not None:
+        count = min(count, jobs)
+    return max(1, count)
+
+def _tessdata_dir():
+    """Best guess at the tessdata folder for tesserocr (it does not read pytesseract's settings)."""
+    if os.environ.get("TESSDATA_PREFIX"):
+        return os.environ["TESSDATA_PREFIX"]
+    cmd_dir = os.path.dirname(pytesseract.pytesseract.tesseract_cmd)
+    candidate = os.path.join(cmd_dir, "tessdata")
+    return candidate if cmd_dir and os.path.isdir(candidate) else None
+
+def _ocr_worker_init(lang):
+    """Loads the language model once per worker process."""
+    _WORKER_STATE['lang'] = lang
+    _WORKER_STATE['docs'] = {}
+    _WORKER_STATE['api'] = None
+    if tesserocr is not None:
+        try:
+            path = _tessdata_dir()
+            api = tesserocr.PyTessBaseAPI(path=path, lang=lang) if path else tesserocr.PyTessBaseAPI(lang=lang)
+            _WORKER_STATE['api'] = api
+        except RuntimeError:
+            # Model not found by the C API; fall back to the tesseract CLI
+            pass
+
+def _worker_doc(pdf_path):
+    """Returns an open fitz document, shared by everything the current task does with that file."""
+    docs = _WORKER_STATE.setdefault('docs', {})
+    doc = docs.get(pdf_path)
+    if doc is None:
+        doc = docs[pdf_path] = fitz.open(pdf_path)
+    return doc
+
+def _closes_worker_docs(task):
+    """
+    Closes the task's documents when it returns. Pool workers outlive the job, and an
+    open handle would keep Windows from deleting or overwriting the source afterwards.
+    """
+    @functools.wraps(task)
+    def wrapper(*args, **kwargs):
+        try:
+            return task(*args, **kwargs)
+        finally:
+            docs = _WORKER_STATE.get('docs')
+            while docs:
+                docs.popitem()[1].close()
+    return wrapper
+
+# --- RENDER SERVICE ---
+# Every rasterization in the app (page images, thumbnails, OCR, slides, grayscale)
+# goes through _render_page, which runs inside pool workers against the document
+# cache above. RenderService owns the shared pool the tools submit to.
+
+RenderRequest = namedtuple("RenderRequest", "page dpi colorspace clip fmt out_file",
+                           defaults=(150, "rgb", None, None, None))
+RenderRequest.__doc__ = """
+One page render: colorspace "rgb" or "gray"; clip is a rect in page points;
+fmt None returns raw samples, "jpeg"/"png" returns encoded bytes, or with
+out_file the image is written to disk and the path returned.
+"""
+
+class RenderResult(namedtuple("RenderResult", "page width height mode data")):
+    """Rendered page: mode is a PIL mode, data is raw samples, encoded bytes or a path."""
+    __slots__ = ()
+
+    def image(self):
+        return Image.frombytes(self.mode, (self.width, self.height), self.data)
+
+# Oversized pages (A0 drawings, posters) are rendered in fixed-budget tiles so
+# memory is bounded by the tile, not the page.
+_TILE_PIXELS = 4_000_000
+_TILED_PAGE_PIXELS = 40_000_000
+
+def _page_irect(page, dpi, clip=None):
+    """Pixel rectangle a render of page (or clip, in page points) covers at dpi."""
+    zoom = dpi / 72.0
+    return ((fitz.Rect(clip) if clip else page.rect) * fitz.Matrix(zoom, zoom)).irect
+
+def _needs_tiling(page, dpi, clip=None):
+    r = _page_irect(page, dpi, clip)
+    return r.width * r.height > _TILED_PAGE_PIXELS
+
+def _render_box(page, dpi, box, gray):
+    """Renders the pixel box (x0, y0, x1, y1) exactly, as an HxWxC uint8 array."""
+    zoom = dpi / 72.0
+    x0, y0, x1, y1 = box
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY if gray else fitz.csRGB,
+                          clip=fitz.Rect(x0 / zoom, y0 / zoom, x1 / zoom, y1 / zoom))
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    # The clip is rounded outwards to whole pixels; cut (or edge-pad) back to the exact box
+    arr = arr[max(0, y0 - pix.y):y1 - pix.y, max(0, x0 - pix.x):x1 - pix.x]
+    short_y, short_x = (y1 - y0) - arr.shape[0], (x1 - x0) - arr.shape[1]
+    if short_y > 0 or short_x > 0:
+        arr = np.pad(arr, ((0, max(0, short_y)), (0, max(0, short_x)), (0, 0)), mode="edge")
+    return arr
+
+def _iter_bands(page, dpi, gray, clip=None):
+    """Yields full-width horizontal bands of at most _TILE_PIXELS pixels, top to bottom."""
+    full = _page_irect(page, dpi, clip)
+    band_h = max(16, _TILE_PIXELS // max(1, full.width))
+    for y in range(full.y0, full.y1, band_h):
+        yield _render_box(page, dpi, (full.x0, y, full.x1, min(y + band_h, full.y1)), gray)
+
+def _write_png_bands(fp, width, height, gray, bands):
+    """Streams bands into a PNG (no filtering, one zlib stream split over IDAT chunks)."""
+    def chunk(tag, data):
+        fp.write(struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data)))
+    fp.write(b"\x89PNG\r\n\x1a\n")
+    chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0 if gray else 2, 0, 0, 0))
+    comp = zlib.compressobj(6)
+    for band in bands:
+        rows = np.zeros((band.shape[0], 1 + band.shape[1] * band.shape[2]), dtype=np.uint8)
+        rows[:, 1:] = band.reshape(band.shape[0], -1)  # column 0 is the per-row filter byte (none)
+        data = comp.compress(rows.tobytes())
+        if data:
+            chunk(b"IDAT", data)
+    chunk(b"IDAT", comp.flush())
+    chunk(b"IEND", b"")
+
+def _write_jpeg_bands(fp, width, height, gray, bands):
+    """Stitches bands into a disk-backed buffer that PIL encodes without copying it into RAM."""
+    fd, tmp = tempfile.mkstemp(suffix=".raw")
+    os.close(fd)
+    try:
+        mode = "L" if gray else "RGBX"
+        mm = np.memmap(tmp, dtype=np.uint8, mode="w+", shape=(height, width, 1 if gray else 4))
+        if not gray:
+            mm[..., 3] = 255
+        y = 0
+        for band in bands:
+            mm[y:y + band.shape[0], :, :band.shape[2]] = band
+            y += band.shape[0]
+        img = Image.frombuffer(mode, (width, height), mm, "raw", mode, 0, 1)
+        img.save(fp, "JPEG")
+        del img, mm
+    finally:
+        os.remove(tmp)
+
+def _render_tiled(page, req, gray):
+    full = _page_irect(page, req.dpi, req.clip)
+    writer = _write_png_bands if req.fmt.lower() == "png" else _write_jpeg_bands
+    bands = _iter_bands(page, req.dpi, gray, req.clip)
+    if req.out_file:
+        with open(req.out_file, "wb") as f:
+            writer(f, full.width, full.height, gray, bands)
+        data = req.out_file
+    else:
+        buf = io.BytesIO()
+        writer(buf, full.width, full.height, gray, bands)
+        data = buf.getvalue()
+    return RenderResult(req.page, full.width, full.height, "L" if gray else "RGB", data)
+
+def _render_page(pdf_path, req):
+    """Worker side of the render service."""
+    page = _worker_doc(pdf_path)[req.page]
+    gray = req.colorspace == "gray"
+    if req.fmt and req.fmt.lower() in ("jpeg", "jpg", "png") and _needs_tiling(page, req.dpi, req.clip):
+        return _render_tiled(page, req, gray)
+    pix = page.get_pixmap(dpi=req.dpi, colorspace=fitz.csGRAY if gray else fitz.csRGB,
+                          clip=fitz.Rect(req.clip) if req.clip else None)
+    mode = "L" if gray else "RGB"
+    if not req.fmt:
+        return RenderResult(req.page, pix.width, pix.height, mode, pix.samples)
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    if req.out_file:
+        img.save(req.out_file, req.fmt.upper())
+        data = req.out_file
+    else:
+        buf = io.BytesIO()
+        img.save(buf, req.fmt.upper())
+        data = buf.getvalue()
+    return RenderResult(req.page, pix.width, pix.height, mode, data)
+
+@_closes_worker_docs
+def _render_batch_worker(pdf_path, batch):
+    return [_render_page(pdf_path, req) for req in batch]
+
+class RenderService:
+    """
+    Shared multi-process renderer. Requests are sent in batches, so each worker
+    opens the document once per batch and IPC round-trips stay few, and every
+    raster-heavy tool draws from the same pool instead of starting its own.
+    """
+    _pool = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def pool(cls):
+        with cls._lock:
+            if cls._pool is None:
+                cls._pool = ProcessPoolExecutor(max_workers=_worker_count())
+            return cls._pool
+
+    @classmethod
+    def render(cls, pdf_path, requests, batch_size=4, window=None):
+        """
+        Yields a RenderResult per request, in request order. At most `window`
+        batches are in flight, so memory stays bounded on long documents.
+        """
+        pool = cls.pool()
+        window = window or _worker_count() * 2
+        pending = deque()
+        requests = list(requests)
+        try:
+            for start in range(0, len(requests), batch_size):
+                pending.append(pool.submit(_render_batch_worker, pdf_path, requests[start:start + batch_size]))
+                if len(pending) >= window:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        except BrokenProcessPool:
+            cls.shutdown()
+            raise Exception("A render worker process crashed. Please try again.")
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            pool, cls._pool = cls._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+def _ocr_words(img):
+    """Runs recognition on a PIL image and returns [(x0, y0, x1, y1, text), ...] in pixels."""
+    api = _WORKER_STATE.get('api')
+    words = []
+    if api is not None:
+        api.SetImage(img)
+        api.Recognize()
+        level = tesserocr.RIL.WORD
+        for r in tesserocr.iterate_level(api.GetIterator(), level):
+            try:
+                text = r.GetUTF8Text(level)
+            except RuntimeError:  # blank image: the iterator has no words to yield
+                break
+            box = r.BoundingBox(level)
+            if text and text.strip() and box:
+                words.append((*box, text.strip()))
+        return words
+    data = pytesseract.image_to_data(img, lang=_WORKER_STATE['lang'], output_type=pytesseract.Output.DICT)
+    for i, text in enumerate(data['text']):
+        if text.strip():
+            x, y, w, h = data['left'][i], data['top'][i], data['width'][i], data['height'][i]
+            words.append((x, y, x + w, y + h, text.strip()))
+    return words
+
+# Tesseract's own trick for the text layer: a Type0 font whose CIDs are the UTF-16 code
+# units, every CID drawn with one empty glyph, and an identity ToUnicode map. Any
+# script round-trips through copy/search, and no real glyphs need embedding.
+_GLYPHLESS_TOUNICODE = (b"/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+                        b"/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+                        b"/CMapName /Adobe-Identity-UCS def /CMapType 2 def\n"
+                        b"1 begincodespacerange <0000> <FFFF> endcodespacerange\n"
+                        b"1 beginbfrange <0000> <FFFF> <0000> endbfrange\n"
+                        b"endcmap CMapName currentdict /CMap defineresource pop end end\n")
+_GLYPHLESS_WIDTH = 0.5  # every glyph advances half an em; Tz stretches words to their boxes
+
+@functools.lru_cache(maxsize=1)
+def _glyphless_ttf():
+    """A two-glyph TrueType font (.notdef plus one blank glyph) for the invisible text layer."""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    fb = FontBuilder(1000, isTTF=True)
+    fb.setupGlyphOrder([".notdef", "space"])
+    fb.setupCharacterMap({0x20: "space"})
+    blank = TTGlyphPen(None).glyph()
+    fb.setupGlyf({".notdef": blank, "space": blank})
+    fb.setupHorizontalMetrics({".notdef": (500, 0), "space": (500, 0)})
+    fb.setupHorizontalHeader(ascent=1000, descent=0)
+    fb.setupNameTable({"familyName": "GlyphLessFont", "styleName": "Regular"})
+    fb.setupOS2(sTypoAscender=1000, sTypoDescender=0, usWinAscent=1000, usWinDescent=0)
+    fb.setupPost()
+    buf = io.BytesIO()
+    fb.save(buf)
+    return buf.getvalue()
+
+def _add_stream_object(doc, data, entries=""):
+    xref = doc.get_new_xref()
+    doc.update_object(xref, f"<<{entries}>>")
+    doc.update_stream(xref, data, compress=True)
+    return xref
+
+def _add_glyphless_font(doc):
+    """Adds the glyphless Type0 font to a fitz document and returns its xref."""
+    font_file = _add_stream_object(doc, _glyphless_ttf(), f"/Length1 {len(_glyphless_ttf())}")
+    cid_to_gid = _add_stream_object(doc, b"\x00\x01" * 65536)
+    to_unicode = _add_stream_object(doc, _GLYPHLESS_TOUNICODE)
+    descriptor = doc.get_new_xref()
+    doc.update_object(descriptor, "<</Type/FontDescriptor/FontName/GlyphLessFont/Flags 5"
+                                  "/FontBBox[0 0 500 1000]/ItalicAngle 0/Ascent 1000/Descent 0"
+                                  f"/CapHeight 1000/StemV 80/FontFile2 {font_file} 0 R>>")
+    descendant = doc.get_new_xref()
+    doc.update_object(descendant, "<</Type/Font/Subtype/CIDFontType2/BaseFont/GlyphLessFont"
+                                  "/CIDSystemInfo<</Registry(Adobe)/Ordering(Identity)/Supplement 0>>"
+                                  f"/FontDescriptor {descriptor} 0 R/CIDToGIDMap {cid_to_gid} 0 R"
+                                  f"/DW {int(_GLYPHLESS_WIDTH * 1000)}>>")
+    font = doc.get_new_xref()
+    doc.update_object(font, "<</Type/Font/Subtype/Type0/BaseFont/GlyphLessFont/Encoding/Identity-H"
+                            f"/DescendantFonts[{descendant} 0 R]/ToUnicode {to_unicode} 0 R>>")
+    return font
+
+def _set_page_font(page, name, font):
+    """Registers a font xref under /Resources/Font/<name>, following indirect and inherited dicts."""
+    doc = page.parent
+    kind, value = doc.xref_get_key(page.xref, "Resources")
+    if kind == "null":
+        # Inherited from the page tree: give the page its own reference to the same dict
+        parent = page.xref
+        while kind == "null":
+            ptype, pref = doc.xref_get_key(parent, "Parent")
+            if ptype != "xref":
+                value = "<<>>"
+                break
+            parent = int(pref.split()[0])
+            kind, value = doc.xref_get_key(parent, "Resources")
+        doc.xref_set_key(page.xref, "Resources", value)
+        kind, value = doc.xref_get_key(page.xref, "Resources")
+    target, path = (int(value.split()[0]), "") if kind == "xref" else (page.xref, "Resources/")
+    kind, value = doc.xref_get_key(target, path + "Font")
+    if kind == "xref":
+        target, path = int(value.split()[0]), ""
+    else:
+        path += "Font/"
+    doc.xref_set_key(target, path + name, f"{font} 0 R")
+
+def _insert_invisible_words(page, words, scale=1.0, font=None):
+    """
+    Writes OCR words onto a fitz page as invisible (render mode 3) but searchable text.
+    Word boxes are in the page's visible orientation; they are mapped back through
+    the derotation matrix so rotated pages line up too. Pass the xref from
+    _add_glyphless_font to share one font across the pages of a document.
+    """
+    doc = page.parent
+    to_pdf = page.derotation_matrix * ~page.transformation_matrix
+    ops = []
+    for x0, y0, x1, y1, text in words:
+        rect = fitz.Rect(x0, y0, x1, y1) * scale
+        units = text.encode("utf-16-be")
+        if rect.is_empty or not units:
+            continue
+        fontsize = rect.height
+        origin = fitz.Point(rect.x0, rect.y1 - 0.2 * fontsize)
+        # Baseline and up vectors in PDF space, so rotated and cropped pages need no special case
+        o, e1, e2 = origin * to_pdf, (origin + (1, 0)) * to_pdf, (origin + (0, -1)) * to_pdf
+        # Stretch along the text direction so selection boxes line up with the word in the image
+        stretch = 100.0 * rect.width / (len(units) // 2 * _GLYPHLESS_WIDTH * fontsize)
+        ops.append(f"/FGlyphLess {fontsize:g} Tf {stretch:g} Tz {e1.x - o.x:g} {e1.y - o.y:g} {e2.x - o.x:g} {e2.y - o.y:g} "
+                   f"{o.x:g} {o.y:g} Tm <{units.hex()}> Tj")
+    if not ops:
+        return
+    if font is None:
+        font = _add_glyphless_font(doc)
+    _set_page_font(page, "FGlyphLess", font)
+    if not page.is_wrapped:
+        page.wrap_contents()
+    content = "q BT 3 Tr\n" + "\n".join(ops) + "\nET Q\n"
+    streams = page.get_contents() + [_add_stream_object(doc, content.encode())]
+    doc.xref_set_key(page.xref, "Contents", "[" + " ".join(f"{x} 0 R" for x in streams) + "]")
+
+def _ocr_image_page(img, words, dpi):
+    """Builds a one-page PDF: the scan as a picture with the recognized words on top."""
+    scale = 72.0 / dpi
+    doc = fitz.open()
+    page = doc.new_page(width=img.width * scale, height=img.height * scale)
+    buf = io.BytesIO()
+    if img.mode in ("RGB", "L"):
+        img.save(buf, "JPEG", quality=85)
+    else:
+        img.save(buf, "PNG")
+    page.insert_image(page.rect, stream=buf.getvalue())
+    _insert_invisible_words(page, words, scale)
+    return doc.tobytes(deflate=True)
+
+# --- SCAN PREPROCESSING ---
+# Pure cv2/NumPy clean-up that runs inside pool workers before OCR (or as its own step).
+# Heavy analysis happens on a copy shrunk to ~1000px; only the final transforms touch full resolution.
+
+def _ink_mask(gray):
+    """Text pixels as 255 on 0, via adaptive thresholding (copes with uneven phone lighting)."""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 31, 15)
+
+def _rotate_small_angle(img, angle, border):
+    h, w = img.shape[:2]
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_LINEAR, borderValue=border)
+
+def _best_skew(mask):
+    """Coarse-to-fine search for the angle whose row profile is spikiest (text lines level)."""
+    best, best_score = 0.0, -1.0
+    for step, span in ((1.0, 10.0), (0.1, 1.0)):
+        center = best
+        for angle in np.arange(center - span, center + span + 1e-6, step):
+            rows = _rotate_small_angle(mask, angle, 0).sum(axis=1, dtype=np.float64)
+            # Relative spread inside the inked span, so margins and the page's aspect ratio
+            # don't make the sideways profile look spiky
+            ink = np.nonzero(rows)[0]
+            if not len(ink):
+                continue
+            rows = rows[ink[0]:ink[-1] + 1]
+            score = float(np.var(rows) / np.mean(rows) ** 2)
+            if score > best_score:
+                best, best_score = float(angle), score
+    return best, best_score
+
+# Flipping a page on thin evidence does more harm than leaving it be: only decide from
+# a few text-sized lines, and only when the ink imbalance is clear
+_UPSIDE_DOWN_MIN_LINES = 3
+_UPSIDE_DOWN_MARGIN = 1.1
+
+def _is_upside_down(mask):
+    """Latin text has more ascenders than descenders, so upright lines carry more ink above their x-height core."""
+    rows = mask.sum(axis=1, dtype=np.float64)
+    if not rows.any():
+        return False
+    on = rows > rows.max() * 0.05
+    above = below = 0.0
+    lines = 0
+    i, n = 0, len(rows)
+    while i < n:
+        if not on[i]:
+            i += 1
+            continue
+        j = i
+        while j < n and on[j]:
+            j += 1
+        band = rows[i:j]
+        # Bands taller than a text line are pictures, rules or tables; they say nothing about orientation
+        if 4 <= len(band) <= max(4, n // 15):
+            core = np.nonzero(band >= band.max() * 0.5)[0]
+            above += band[:core[0]].sum()
+            below += band[core[-1] + 1:].sum()
+            lines += 1
+        i = j
+    return lines >= _UPSIDE_DOWN_MIN_LINES and below > above * _UPSIDE_DOWN_MARGIN
+
+def _analysis_mask(gray):
+    """Ink mask of a copy shrunk to ~1000px on the long side."""
+    scale = min(1.0, 1000.0 / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    return _ink_mask(small)
+
+def _detect_orientation_and_skew(gray):
+    """Returns (clockwise quarter-turn to apply, deskew angle to apply after that turn)."""
+    mask = _analysis_mask(gray)
+    turned = cv2.rotate(mask, cv2.ROTATE_90_CLOCKWISE)
+    angle0, score0 = _best_skew(mask)
+    angle90, score90 = _best_skew(turned)
+    if score0 >= score90:
+        rotation, angle, upright = 0, angle0, mask
+    else:
+        rotation, angle, upright = 90, angle90, turned
+    if _is_upside_down(_rotate_small_angle(upright, angle, 0)):
+        rotation = (rotation + 180) % 360
+        angle = -angle
+    return rotation, angle
+
+_QUARTER_TURNS = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+def _preprocess_scan(gray, rotate=True, deskew=True, binarize=True, crop=True):
+    """
+    Cleans a grayscale page (uint8 ndarray) for OCR: auto-rotate by quarter turns,
+    deskew, binarize to 0/255 and crop to the text region.
+    """
+    angle = 0.0
+    if rotate:
+        rotation, angle = _detect_orientation_and_skew(gray)
+        if rotation:
+            gray = cv2.rotate(gray, _QUARTER_TURNS[rotation])
+    elif deskew:
+        angle = _best_skew(_analysis_mask(gray))[0]
+    if deskew and abs(angle) >= 0.1:
+        gray = _rotate_small_angle(gray, angle, 255)
+    if binarize:
+        gray = 255 - _ink_mask(gray)
+    if crop:
+        ink = cv2.morphologyEx(255 - gray if binarize else _ink_mask(gray), cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+        pts = cv2.findNonZero(ink)
+        if pts is not None:
+            x, y, w, h = cv2.boundingRect(pts)
+            pad = int(0.02 * min(gray.shape))
+            y0, x0 = max(0, y - pad), max(0, x - pad)
+            gray = gray[y0:y + h + pad, x0:x + w + pad]
+    return np.ascontiguousarray(gray)
+
+def _render_gray(pdf_path, page_index, dpi):
+    res = _render_page(pdf_path, RenderRequest(page_index, dpi, "gray"))
+    return np.frombuffer(res.data, dtype=np.uint8).reshape(res.height, res.width)
+
+@_closes_worker_docs
+def _clean_scan_worker(task):
+    """Pool task: render, clean and PNG-encode one page. Returns (png_bytes, width, height)."""
+    pdf_path, page_index, dpi, options = task
+    cleaned = _preprocess_scan(_render_gray(pdf_path, page_index, dpi), **options)
+    img = Image.fromarray(cleaned)
+    if options.get('binarize', True):
+        img = img.convert("1")
+    buf = io.BytesIO()
+    img.save(buf, "PNG", optimize=True)
+    return buf.getvalue(), img.width, img.height
+
+class JobCheckpoint:
+    """
+    Page-granular scratch directory for long jobs. Every finished page is written
+    atomically as its own file. The directory name is derived from the job type,
+    the input file (path, size, mtime) and the job settings, so re-running the
+    same job after a crash finds it again and skips the pages already done.
+    """
+    ROOT = os.path.join(os.path.expanduser("~"), ".localpdfpro", "jobs")
+
+    def __init__(self, job_name, input_path, params=None):
+        st = os.stat(input_path)
+        ident = json.dumps([job_name, os.path.abspath(input_path), st.st_size, st.st_mtime, params],
+                           sort_keys=True, default=str)
+        self.job_dir = os.path.join(self.ROOT, f"{job_name}_{hashlib.sha256(ident.encode()).hexdigest()[:16]}")
+        os.makedirs(self.job_dir, exist_ok=True)
+
+    def path(self, index, ext="bin"):
+        return os.path.join(self.job_dir, f"page_{index:06d}.{ext}")
+
+    def done(self, index, ext="bin"):
+        return os.path.exists(self.path(index, ext))
+
+    def save(self, index, data, ext="bin"):
+        path = self.path(index, ext)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def load(self, index, ext="bin"):
+        with open(self.path(index, ext), "rb") as f:
+            return f.read()
+
+    def finish(self):
+        """Called once the final output is written; the scratch pages are no longer needed."""
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+class OCRCache:
+    """
+    On-disk cache of per-page OCR output, keyed by a hash of the rendered page
+    pixels plus language and DPI. Entries are touched on every hit and the least
+    recently used ones are evicted once the folder grows past max_bytes.
+    Plain files + atomic renames, so pool workers can share it safely.
+    """
+    DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".localpdfpro", "ocr_cache")
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or self.DEFAULT_DIR
+        self.max_bytes = max_bytes or self.DEFAULT_MAX_BYTES
+
+    @staticmethod
+    def hasher(shape, lang, dpi, kind="pdf"):
+        """Incremental form of make_key, for pages hashed tile by tile."""
+        return hashlib.sha256(f"{kind}|{lang}|{dpi}|{shape}|".encode())
+
+    @staticmethod
+    def make_key(pixels, shape, lang, dpi, kind="pdf"):
+        """pixels: any buffer of rendered samples; shape: its (height, width[, channels])."""
+        h = OCRCache.hasher(shape, lang, dpi, kind)
+        h.update(pixels)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".bin")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mtime doubles as the LRU timestamp
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+        entries, total = [], 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+_OCR_TILE_PX = 2400
+_OCR_TILE_OVERLAP = 200
+
+def _tile_grid(full, tile, overlap):
+    """
+    Yields (render_box, core_box) pixel boxes covering the IRect full. Render boxes
+    overlap so words on a seam are seen whole by one tile; the cores do not, so
+    each word is kept exactly once (by the tile whose core holds its centre).
+    """
+    step = tile - overlap
+    half = overlap // 2
+    # Stop before a start would fall inside the previous tile's overlap; the last
+    # tile still reaches the edge because it starts at most `tile` from it
+    for y in range(full.y0, max(full.y0 + 1, full.y1 - overlap), step):
+        for x in range(full.x0, max(full.x0 + 1, full.x1 - overlap), step):
+            box = (x, y, min(x + tile, full.x1), min(y + tile, full.y1))
+            core = (x if x == full.x0 else x + half, y if y == full.y0 else y + half,
+                    box[2] if box[2] == full.x1 else box[2] - half, box[3] if box[3] == full.y1 else box[3] - half)
+            yield box, core
+
+def _ocr_tiled_page(pdf_path, page_index, dpi, cache, kind, preprocess):
+    """OCRs an oversized page tile by tile and merges the word coordinates."""
+    page = _worker_doc(pdf_path)[page_index]
+    lang = _WORKER_STATE['lang']
+    full = _page_irect(page, dpi)
+    grid = list(_tile_grid(full, _OCR_TILE_PX, _OCR_TILE_OVERLAP))
+    key = None
+    if cache:
+        # Hashing pass: tiles are re-rendered below rather than kept in memory
+        h = OCRCache.hasher((full.height, full.width, "tiled"), lang, dpi, kind + ("+clean" if preprocess else ""))
+        for box, _ in grid:
+            h.update(_render_box(page, dpi, box, preprocess))
+        key = h.hexdigest()
+        cached = cache.get(key)
+        if cached:
+            return cached
+
+    words, pictures = [], []
+    for box, core in grid:
+        arr = _render_box(page, dpi, box, preprocess)
+        if preprocess:
+            arr = _preprocess_scan(arr[..., 0], rotate=False, deskew=False, crop=False)
+        else:
+            arr = np.ascontiguousarray(arr)
+        img = Image.fromarray(arr)
+        for x0, y0, x1, y1, text in _ocr_words(img):
+            x0, y0, x1, y1 = x0 + box[0], y0 + box[1], x1 + box[0], y1 + box[1]
+            cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+            if core[0] <= cx < core[2] and core[1] <= cy < core[3]:
+                words.append((x0 - full.x0, y0 - full.y0, x1 - full.x0, y1 - full.y0, text))
+        if kind == "pdf":
+            crop = img.crop((core[0] - box[0], core[1] - box[1], core[2] - box[0], core[3] - box[1]))
+            buf = io.BytesIO()
+            if preprocess:
+                crop.convert("1").save(buf, "PNG")
+            else:
+                crop.save(buf, "JPEG", quality=85)
+            pictures.append(((core[0] - full.x0, core[1] - full.y0, core[2] - full.x0, core[3] - full.y0), buf.getvalue()))
+
+    scale = 72.0 / dpi
+    if kind == "words":
+        result = json.dumps([(x0 * scale, y0 * scale, x1 * scale, y1 * scale, t) for x0, y0, x1, y1, t in words]).encode("utf-8")
+    else:
+        doc = fitz.open()
+        out_page = doc.new_page(width=full.width * scale, height=full.height * scale)
+        for rect, data in pictures:
+            out_page.insert_image(fitz.Rect(rect) * scale, stream=data)
+        _insert_invisible_words(out_page, words, scale)
+        result = doc.tobytes(deflate=True)
+    if cache:
+        cache.put(key, result)
+    return result
+
+@_closes_worker_docs
+def _ocr_page_worker(task):
+    """
+    Renders one page inside the worker and OCRs it. kind="pdf" returns a searchable
+    single-page PDF; kind="words" returns the word boxes (in points) as JSON bytes,
+    for overlaying onto the original page. With preprocess, the page is cleaned up
+    first (only binarized for "words", so the boxes still match the original page).
+    """
+    pdf_path, page_index, dpi, cache_dir, kind, preprocess = task
+    cache = OCRCache(cache_dir) if cache_dir else None
+    if _needs_tiling(_worker_doc(pdf_path)[page_index], dpi):
+        return _ocr_tiled_page(pdf_path, page_index, dpi, cache, kind, preprocess)
+    if preprocess:
+        gray = _render_gray(pdf_path, page_index, dpi)
+        pixels, shape = gray, gray.shape
+    else:
+        res = _render_page(pdf_path, RenderRequest(page_index, dpi))
+        pixels, shape = res.data, (res.height, res.width, 3)
+    if cache:
+        key = OCRCache.make_key(pixels, shape, _WORKER_STATE['lang'], dpi, kind + ("+clean" if preprocess else ""))
+        cached = cache.get(key)
+        if cached:
+            return cached
+    if preprocess:
+        if kind == "words":
+            cleaned = _preprocess_scan(gray, rotate=False, deskew=False, crop=False)
+        else:
+            cleaned = _preprocess_scan(gray)
+        img = Image.fromarray(cleaned)
+    else:
+        img = res.image()
+    if kind == "words":
+        scale = 72.0 / dpi
+        words = [(x0 * scale, y0 * scale, x1 * scale, y1 * scale, text) for x0, y0, x1, y1, text in _ocr_words(img)]
+        result = json.dumps(words).encode("utf-8")
+    elif _WORKER_STATE.get('api') is None:
+        result = pytesseract.image_to_pdf_or_hocr(img, extension='pdf', lang=_WORKER_STATE['lang'])
+    else:
+        # Bitonal scans embed far smaller as 1-bit PNG than as JPEG
+        page_img = img.convert("1") if preprocess else img
+        result = _ocr_image_page(page_img, _ocr_words(img), dpi)
+    if cache:
+        cache.put(key, result)
+    return result
+
+class OCRWorkerPool:
+    """
+    Long-lived OCR processes shared by every OCR job in the session.
+    Each pool is keyed by (language, size) so a worker's loaded model always matches.
+    """
+    _pools = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, lang, workers=None):
+        key = (lang, _worker_count(workers))
+        with cls._lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=key[1], initializer=_ocr_worker_init, initargs=(lang,))
+                cls._pools[key] = pool
+            return pool
+
+    @classmethod
+    def discard(cls, lang, workers=None):
+        """Drops a pool (e.g. after a worker crashed) so the next job starts a fresh one."""
+        with cls._lock:
+            pool = cls._pools.pop((lang, _worker_count(workers)), None)
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            pools, cls._pools = list(cls._pools.values()), {}
+        for pool in pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+# --- STREAMING WRITER ---
+# Writes a PDF object by object straight to disk. Inputs are copied one at a
+# time, so memory is bounded by the largest single input, and objects are
+# deduplicated across inputs by content hash.
+
+_INHERITABLE_PAGE_KEYS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+_IN_PROGRESS = object()
+
+def _uncopied_objgens(pdf):
+    """The catalog, page-tree nodes and pages: never copied as plain objects."""
+    ids = {pdf.Root.objgen}
+    nodes = [pdf.Root.Pages]
+    while nodes:
+        node = nodes.pop()
+        ids.add(node.objgen)
+        nodes.extend(kid for kid in node.get("/Kids", []) if kid.get("/Type") == "/Pages")
+    ids.update(page.obj.objgen for page in pdf.pages)
+    return ids
+
+class _StreamingPdfWriter:
+    """
+    Usage: with _StreamingPdfWriter(fp) as w: w.copy_pages(pdf); w.add_outline(...).
+    Stream bytes are copied raw (never decoded). Two objects are merged when the
+    SHA-256 of their serialized dictionary (plus raw bytes, for streams) match;
+    because children are written first, an image whose colour space was merged,
+    or a form drawing merged resources, is merged too. Form fields, named
+    destinations and optional content of the copied pages are carried over into
+    the output's catalog, and the first input's document info into its trailer.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.offsets = [None]  # index = object number
+        self.page_nums = []
+        self.outline = []  # (level, title, page object number)
+        self._seen = {}  # digest -> object number
+        # Catalog entries gathered from the inputs, already serialized; first input wins on clashes
+        self.fields, self.form_entries, self.form_resources = [], {}, {}
+        self.dests, self.name_dests = {}, {}  # string-keyed name tree, legacy name-keyed /Dests
+        self.ocgs, self.oc_config, self.oc_lists = [], {}, {"/ON": [], "/OFF": [], "/Order": []}
+        self.info = None
+        self.pages_num = self._reserve()
+        fp.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def _reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def _write(self, num, body, raw=None):
+        self.offsets[num] = self.fp.tell()
+        self.fp.write(b"%d 0 obj\n" % num + body)
+        if raw is not None:
+            self.fp.write(b"\nstream\n" + raw + b"\nendstream")
+        self.fp.write(b"\nendobj\n")
+
+    def _value(self, obj, objmap):
+        """Serializes a direct value; indirect objects become references, copied on first sight."""
+        if isinstance(obj, pikepdf.Object) and obj.is_indirect:
+            return self._ref(obj, objmap)
+        if obj is None:
+            return b"null"
+        if isinstance(obj, bool):
+            return b"true" if obj else b"false"
+        if isinstance(obj, int):
+            return b"%d" % obj
+        if isinstance(obj, (float, Decimal)):
+            return format(Decimal(obj).normalize(), "f").encode()
+        if isinstance(obj, pikepdf.Array):
+            return b"[" + b" ".join(self._value(v, objmap) for v in obj) + b"]"
+        if isinstance(obj, pikepdf.Dictionary):
+            return self._dict(obj.items(), objmap)
+        return obj.unparse()  # names and strings
+
+    def _dict(self, items, objmap):
+        return b"<<" + b"".join(pikepdf.Name(k).unparse() + b" " + self._value(v, objmap) for k, v in items) + b">>"
+
+    def _ref(self, obj, objmap):
+        num = objmap.get(obj.objgen)
+        if num is None and obj.objgen in objmap:
+            return b"null"  # the input's catalog or page tree: never copied
+        if num is _IN_PROGRESS:
+            num = objmap[obj.objgen] = self._reserve()  # a cycle back into an object being copied
+        if num is not None:
+            return b"%d 0 R" % num
+
+        # Children are written first, so the body already holds final (deduplicated) numbers
+        objmap[obj.objgen] = _IN_PROGRESS
+        raw = None
+        if isinstance(obj, pikepdf.Stream):
+            raw = obj.read_raw_bytes()
+            body = self._dict(((k, v) for k, v in obj.stream_dict.items() if k != "/Length"), objmap)
+        elif isinstance(obj, pikepdf.Array):
+            body = b"[" + b" ".join(self._value(v, objmap) for v in obj) + b"]"
+        elif isinstance(obj, pikepdf.Dictionary):
+            body = self._dict(obj.items(), objmap)
+        else:
+            body = obj.unparse()
+        digest = hashlib.sha256(body + b"\0" + (raw or b"")).digest()
+        # An annotation (and a widget's field) belongs to one page, however alike two of them look
+        mergeable = not (isinstance(obj, pikepdf.Dictionary) and "/Rect" in obj)
+        num = objmap[obj.objgen]
+        if num is _IN_PROGRESS:
+            num = self._seen.get(digest) if mergeable else None
+            if num is not None:
+                objmap[obj.objgen] = num
+                return b"%d 0 R" % num
+            num = objmap[obj.objgen] = self._reserve()
+        # Objects on a reference cycle keep their own number and are not merged
+        if mergeable:
+            self._seen.setdefault(digest, num)
+        if raw is not None:
+            body = body[:-2] + b"/Length %d>>" % len(raw)
+        self._write(num, body, raw)
+        return b"%d 0 R" % num
+
+    def copy_pages(self, pdf, indices=None, uncopied=None):
+        """
+        Copies pages (all, or the 0-based `indices`) of an open pikepdf.Pdf;
+        returns their object numbers in the output. uncopied: the source's
+        _uncopied_objgens(), worth passing in when copying from it repeatedly.
+        """
+        # References to the catalog, page tree or pages left out become null
+        objmap = dict.fromkeys(uncopied if uncopied is not None else _uncopied_objgens(pdf))
+        pages = list(pdf.pages) if indices is None else [pdf.pages[i] for i in indices]
+        nums = []
+        for page in pages:
+            num = self._reserve()
+            if objmap.get(page.obj.objgen) is None:
+                objmap[page.obj.objgen] = num
+            nums.append(num)
+        for page, num in zip(pages, nums):
+            items = {k: v for k, v in page.obj.items() if k not in ("/Parent", "/B")}
+            node = page.obj.get("/Parent")
+            while node is not None:  # push inherited attributes down onto the page
+                for key in _INHERITABLE_PAGE_KEYS:
+                    if key not in items and key in node:
+                        items[key] = node[key]
+                node = node.get("/Parent")
+            body = self._dict(items.items(), objmap)
+            self._write(num, body[:-2] + b"/Parent %d 0 R>>" % self.pages_num)
+        self.page_nums.extend(nums)
+        self._collect_catalog(pdf, objmap)
+        return nums
+
+    @staticmethod
+    def _copied(obj, objmap):
+        return isinstance(obj, pikepdf.Object) and obj.is_indirect and isinstance(objmap.get(obj.objgen), int)
+
+    def _dest_on_pages(self, dest, objmap):
+        if isinstance(dest, pikepdf.Dictionary):
+            dest = dest.get("/D")
+        return isinstance(dest, pikepdf.Array) and len(dest) > 0 and self._copied(dest[0], objmap)
+
+    def _collect_catalog(self, pdf, objmap):
+        """
+        Gathers the catalog entries that belong with the pages just copied. Fields
+        and destinations are only taken when they reach a copied widget or page, so
+        a split part does not carry the rest of the document's form.
+        """
+        root = pdf.Root
+        form = root.get("/AcroForm")
+        if isinstance(form, pikepdf.Dictionary):
+            # Copying a page copies its widgets and, through /Parent, their fields
+            for field in form.get("/Fields", []):
+                if self._copied(field, objmap):
+                    ref = self._value(field, objmap)
+                    if ref not in self.fields:
+                        self.fields.append(ref)
+            for key in ("/DA", "/Q", "/NeedAppearances"):
+                if key in form and key not in self.form_entries:
+                    self.form_entries[key] = self._value(form[key], objmap)
+            resources = form.get("/DR")
+            for category, entries in (resources.items() if isinstance(resources, pikepdf.Dictionary) else []):
+                merged = self.form_resources.setdefault(category, {})
+                for name, value in (entries.items() if isinstance(entries, pikepdf.Dictionary) else []):
+                    if name not in merged:
+                        merged[name] = self._value(value, objmap)
+
+        names = root.get("/Names")
+        tree = names.get("/Dests") if isinstance(names, pikepdf.Dictionary) else None
+        stack, visited = [tree] if isinstance(tree, pikepdf.Dictionary) else [], set()
+        while stack:
+            node = stack.pop()
+            if node.is_indirect:
+                if node.objgen in visited:
+                    continue
+                visited.add(node.objgen)
+            stack.extend(kid for kid in node.get("/Kids", []) if isinstance(kid, pikepdf.Dictionary))
+            leaf = list(node.get("/Names", []))
+            for key, dest in zip(leaf[0::2], leaf[1::2]):
+                key = bytes(key)
+                if key not in self.dests and self._dest_on_pages(dest, objmap):
+                    self.dests[key] = self._value(dest, objmap)
+        legacy = root.get("/Dests")
+        for key, dest in (legacy.items() if isinstance(legacy, pikepdf.Dictionary) else []):
+            if key not in self.name_dests and self._dest_on_pages(dest, objmap):
+                self.name_dests[key] = self._value(dest, objmap)
+
+        layers = root.get("/OCProperties")
+        if isinstance(layers, pikepdf.Dictionary):
+            for ocg in layers.get("/OCGs", []):
+                ref = self._value(ocg, objmap)
+                if ref not in self.ocgs:
+                    self.ocgs.append(ref)
+            config = layers.get("/D")
+            for key, value in (config.items() if isinstance(config, pikepdf.Dictionary) else []):
+                if key in self.oc_lists:
+                    self.oc_lists[key].extend(self._value(v, objmap) for v in value)
+                elif key not in self.oc_config:
+                    self.oc_config[key] = self._value(value, objmap)
+
+        info = pdf.trailer.get("/Info")
+        if self.info is None and isinstance(info, pikepdf.Dictionary):
+            if info.is_indirect:
+                self.info = self._ref(info, objmap)
+            else:
+                self.info = b"%d 0 R" % self._reserve()
+                self._write(int(self.info.split()[0]), self._value(info, objmap))
+
+    def _add_stream(self, entries, raw):
+        """Writes a stream (dictionary entries as bytes) unless the same one exists; returns its number."""
+        digest = hashlib.sha256(entries + b"\0" + raw).digest()
+        num = self._seen.get(digest)
+        if num is None:
+            num = self._seen[digest] = self._reserve()
+            self._write(num, b"<<%s /Length %d>>" % (entries, len(raw)), raw)
+        return num
+
+    def add_image_page(self, image):
+        """Appends a page showing a _PreparedImage at its resolution; returns the page's number."""
+        entries = image.image_dict
+        if image.smask is not None:
+            smask = self._add_stream(b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray "
+                                     b"/BitsPerComponent 8 /Filter /FlateDecode" % (image.width, image.height), image.smask)
+            entries += b" /SMask %d 0 R" % smask
+        xobject = self._add_stream(entries, image.data)
+        w, h = image.width * 72.0 / image.dpi[0], image.height * 72.0 / image.dpi[1]
+        content = self._add_stream(b"", b"q %.3f 0 0 %.3f 0 0 cm /Im0 Do Q" % (w, h))
+        num = self._reserve()
+        rotate = b" /Rotate %d" % image.rotate if image.rotate else b""
+        self._write(num, b"<</Type /Page /Parent %d 0 R /MediaBox [0 0 %.3f %.3f] /Resources <</XObject <</Im0 %d 0 R>>>> "
+                         b"/Contents %d 0 R%s>>" % (self.pages_num, w, h, xobject, content, rotate))
+        self.page_nums.append(num)
+        return num
+
+    def add_outline(self, entries):
+        """entries: [(level, title, page object number)], levels starting at 1."""
+        self.outline.extend(entries)
+
+    def _write_outline(self):
+        root = {"children": []}
+        stack = [root]
+        for level, title, page_num in self.outline:
+            level = max(1, min(level, len(stack)))
+            del stack[level:]
+            item = {"title": title, "page": page_num, "children": [], "num": self._reserve()}
+            stack[-1]["children"].append(item)
+            stack.append(item)
+        root["num"] = self._reserve()
+        todo = [root]
+        while todo:
+            node = todo.pop()
+            kids = node["children"]
+            entries = []
+            if "title" in node:
+                entries.append(b"/Title " + pikepdf.String(node["title"]).unparse())
+                entries.append(b"/Parent %d 0 R" % node["parent"])
+                entries.append(b"/Dest [%d 0 R /XYZ null null null]" % node["page"])
+                if node.get("prev"):
+                    entries.append(b"/Prev %d 0 R" % node["prev"])
+                if node.get("next"):
+                    entries.append(b"/Next %d 0 R" % node["next"])
+            else:
+                entries.append(b"/Type /Outlines")
+            if kids:
+                entries.append(b"/First %d 0 R /Last %d 0 R" % (kids[0]["num"], kids[-1]["num"]))
+                # Top level open, nested levels collapsed
+                entries.append(b"/Count %d" % (len(kids) if node is root else -len(kids)))
+            for i, kid in enumerate(kids):
+                kid["parent"] = node["num"]
+                kid["prev"] = kids[i - 1]["num"] if i else None
+                kid["next"] = kids[i + 1]["num"] if i + 1 < len(kids) else None
+                todo.append(kid)
+            self._write(node["num"], b"<<" + b" ".join(entries) + b">>")
+        return root["num"]
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % n for n in self.page_nums)
+        self._write(self.pages_num, b"<</Type /Pages /Kids [%s] /Count %d>>" % (kids, len(self.page_nums)))
+        outline = b" /Outlines %d 0 R /PageMode /UseOutlines" % self._write_outline() if self.outline else b""
+        extra = b"".join(b" %s %s" % (key, value) for key, value in self._catalog_entries())
+        root = self._reserve()
+        self._write(root, b"<</Type /Catalog /Pages %d 0 R%s%s>>" % (self.pages_num, outline, extra))
+        xref = self.fp.tell()
+        self.fp.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self.offsets))
+        self.fp.write(b"".join(b"%010d 00000 n \n" % off for off in self.offsets[1:]))
+        file_id = hashlib.md5(b"%d|%d" % (xref, len(self.offsets))).hexdigest().encode()
+        info = b" /Info " + self.info if self.info else b""
+        self.fp.write(b"trailer\n<</Size %d /Root %d 0 R%s /ID [<%s> <%s>]>>\nstartxref\n%d\n%%%%EOF\n"
+                      % (len(self.offsets), root, info, file_id, file_id, xref))
+
+    def _catalog_entries(self):
+        """Yields (key, value) byte pairs for the catalog from what _collect_catalog gathered."""
+        def array(values):
+            return b"[" + b" ".join(values) + b"]"
+
+        def dictionary(items):
+            return b"<<" + b" ".join(pikepdf.Name(k).unparse() + b" " + v for k, v in items) + b">>"
+
+        if self.fields:
+            form = [("/Fields", array(self.fields))] + list(self.form_entries.items())
+            if self.form_resources:
+                form.append(("/DR", dictionary((k, dictionary(v.items())) for k, v in self.form_resources.items())))
+            yield b"/AcroForm", dictionary(form)
+        if self.dests:
+            # Name tree leaves must be sorted by key
+            leaf = b" ".join(pikepdf.String(k).unparse() + b" " + self.dests[k] for k in sorted(self.dests))
+            yield b"/Names", b"<</Dests <</Names [%s]>>>>" % leaf
+        if self.name_dests:
+            yield b"/Dests", dictionary(self.name_dests.items())
+        if self.ocgs:
+            config = list(self.oc_config.items()) + [(k, array(v)) for k, v in self.oc_lists.items() if v]
+            yield b"/OCProperties", b"<</OCGs %s /D %s>>" % (array(self.ocgs), dictionary(config))
+
+# --- SPLITTING ---
+
+def _parse_page_range(page_range, total_pages):
+    """
+    "1-3, 7, 10-" (1-based, inclusive, open-ended ranges run to the last page)
+    -> 0-based indices in the order given. Raises ValueError on bad input.
+    """
+    indices = []
+    for part in (p.strip() for p in page_range.split(",")):
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start, end = (s.strip() for s in part.split("-", 1))
+                start, end = int(start), int(end) if end else total_pages
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"Invalid page range item '{part}'.") from None
+        if start > end:
+            raise ValueError(f"Page range '{part}' runs backwards.")
+        if start < 1 or end > total_pages:
+            raise ValueError(f"Page range '{part}' is outside 1-{total_pages}.")
+        indices.extend(range(start - 1, end))
+    if not indices:
+        raise ValueError("No pages selected.")
+    return indices
+
+_PAGE_OVERHEAD = 256  # page dictionary, xref entry and /Kids slot, in bytes
+
+def _page_stream_sizes(pdf, indices):
+    """
+    For each page, {objgen: bytes} of the streams it draws with (contents, fonts,
+    images, forms), from /Length only. Lets parts be packed by size, counting
+    resources shared between pages of a part once.
+    """
+    result = []
+    containers = (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream)
+    for i in indices:
+        page = pdf.pages[i].obj
+        streams, seen = {}, set()
+        stack = [v for k, v in page.items() if k not in ("/Parent", "/Annots", "/B")]
+        while stack:
+            obj = stack.pop()
+            if not isinstance(obj, containers):
+                continue
+            if obj.is_indirect:
+                if obj.objgen in seen or (isinstance(obj, pikepdf.Dictionary) and obj.get("/Type") == "/Page"):
+                    continue
+                seen.add(obj.objgen)
+                if isinstance(obj, pikepdf.Stream):
+                    streams[obj.objgen] = int(obj.get("/Length", 0))
+            stack.extend(obj if isinstance(obj, pikepdf.Array) else obj.values())
+        result.append(streams)
+    return result
+
+def _split_worker(task):
+    """task = (out_file, page indices). Writes the part from the worker's open source."""
+    out_file, indices = task
+    pdf = _WORKER_STATE['pdf']
+    if 'uncopied' not in _WORKER_STATE:
+        _WORKER_STATE['uncopied'] = _uncopied_objgens(pdf)
+    with open(out_file, "wb") as f, _StreamingPdfWriter(f) as writer:
+        writer.copy_pages(pdf, indices, _WORKER_STATE['uncopied'])
+    return out_file
+
+def _safe_filename(text, limit=60):
+    cleaned = "".join(c if c.isalnum() or c in " -_" else "_" for c in text).strip()
+    return cleaned[:limit] or "untitled"
+
+# --- IMAGE EXTRACTION ---
+# The parent reads raw streams to dedupe and copies JPEG/JPX through; images that
+# need decoding go to pool workers in batches, each decoding and PNG-encoding its own.
+
+_EXTRACT_BATCH = 8
+
+def _unused_name(folder, name):
+    """name, or name with _2, _3... before the extension if a file of that name exists."""
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while os.path.exists(os.path.join(folder, candidate)):
+        n += 1
+        candidate = f"{stem}_{n}{ext}"
+    return candidate
+
+@_closes_worker_docs
+def _extract_images_worker(pdf_path, batch):
+    """batch: [(xref, smask xref or 0, output path)]. Writes each image as PNG."""
+    doc = _worker_doc(pdf_path)
+    for xref, smask, out_path in batch:
+        pix = fitz.Pixmap(doc, xref)
+        # Convert CMYK to RGB if needed
+        if pix.n - pix.alpha > 3:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        mode = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}[pix.n]
+        img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+        if smask:
+            try:
+                mask = fitz.Pixmap(doc, smask)
+                alpha = Image.frombytes("L", (mask.width, mask.height), mask.samples) if mask.n == 1 else \
+                    Image.frombytes({3: "RGB", 4: "CMYK"}.get(mask.n, "RGB"), (mask.width, mask.height), mask.samples).convert("L")
+                # Soft masks may have their own resolution; stretch them over the image
+                if alpha.size != img.size:
+                    alpha = alpha.resize(img.size, Image.BILINEAR)
+                img.putalpha(alpha)
+            except Exception:
+                pass  # an unreadable mask should not cost the image; save it opaque
+        img.save(out_path, "PNG")
+
+# --- IMAGE INGESTION ---
+# images_to_pdf prepares images in pool workers (passthrough where the file's
+# own stream is valid PDF data, else a lossless Flate re-encode with the alpha
+# split out as an /SMask) and the parent streams them out in order, holding
+# only a small window of prepared images at a time.
+
+_DEFAULT_IMAGE_DPI = 96  # for images that do not say, as img2pdf assumes
+_EXIF_ROTATION = {3: 180, 6: 90, 8: 270}  # orientations a page /Rotate can express
+
+# image_dict: the XObject dictionary entries (without /Length or /SMask), as bytes
+_PreparedImage = namedtuple("_PreparedImage", "width height dpi rotate image_dict data smask")
+
+def _png_chunks(data):
+    pos = 8
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        yield kind, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+def _png_passthrough(data):
+    """(image_dict, IDAT bytes) for PNGs a PDF can embed as they are, else None."""
+    chunks = list(_png_chunks(data))
+    if not chunks or chunks[0][0] != b"IHDR":
+        return None
+    width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", chunks[0][1])
+    kinds = {kind for kind, _ in chunks}
+    # Alpha, transparency keys and interlacing need decoding
+    if interlace or b"tRNS" in kinds or color_type not in (0, 2, 3) or (color_type == 3 and depth > 8):
+        return None
+    if color_type == 3:
+        palette = next(body for kind, body in chunks if kind == b"PLTE")
+        colorspace = b"[/Indexed /DeviceRGB %d <%s>]" % (len(palette) // 3 - 1, palette.hex().encode())
+        colors = 1
+    else:
+        colorspace, colors = (b"/DeviceGray", 1) if color_type == 0 else (b"/DeviceRGB", 3)
+    image_dict = (b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent %d "
+                  b"/Filter /FlateDecode /DecodeParms <</Predictor 15 /Colors %d /BitsPerComponent %d /Columns %d>>"
+                  % (width, height, colorspace, depth, colors, depth, width))
+    return image_dict, b"".join(body for kind, body in chunks if kind == b"IDAT")
+
+def _prepare_image(source):
+    """source: a path or the file's bytes. Returns a _PreparedImage, or None if unreadable."""
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            data = bytes(source)
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+        img = Image.open(io.BytesIO(data))
+        dpi = img.info.get("dpi") or (_DEFAULT_IMAGE_DPI, _DEFAULT_IMAGE_DPI)
+        dpi = tuple(float(d) if d and float(d) > 1 else _DEFAULT_IMAGE_DPI for d in dpi[:2])
+        orientation = img.getexif().get(0x0112, 1)
+        rotate = _EXIF_ROTATION.get(orientation, 0)
+
+        if orientation in (1, 3, 6, 8):
+            if img.format == "JPEG" and img.mode in ("L", "RGB", "CMYK"):
+                colorspace = {"L": b"/DeviceGray", "RGB": b"/DeviceRGB", "CMYK": b"/DeviceCMYK"}[img.mode]
+                # Photoshop-style CMYK JPEGs store inverted values
+                decode = b" /Decode [1 0 1 0 1 0 1 0]" if img.mode == "CMYK" else b""
+                image_dict = (b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+                              b"/BitsPerComponent 8 /Filter /DCTDecode%s" % (img.width, img.height, colorspace, decode))
+                return _PreparedImage(img.width, img.height, dpi, rotate, image_dict, data, None)
+            if img.format == "PNG":
+                passthrough = _png_passthrough(data)
+                if passthrough:
+                    return _PreparedImage(img.width, img.height, dpi, rotate, *passthrough, None)
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+            rotate = 0
+            if orientation in (5, 6, 7, 8):
+                dpi = dpi[::-1]
+
+        smask = None
+        if img.mode == "P":
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        if img.mode in ("LA", "PA", "RGBA", "La", "RGBa"):
+            alpha = img.getchannel("A")
+            img = img.convert("L" if img.mode in ("LA", "La") else "RGB")
+            if alpha.getextrema() != (255, 255):
+                smask = zlib.compress(alpha.tobytes(), 6)
+        if img.mode not in ("1", "L", "RGB", "CMYK"):
+            img = img.convert("RGB")
+        colorspace = {"1": b"/DeviceGray", "L": b"/DeviceGray", "RGB": b"/DeviceRGB", "CMYK": b"/DeviceCMYK"}[img.mode]
+        image_dict = (b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent %d "
+                      b"/Filter /FlateDecode" % (img.width, img.height, colorspace, 1 if img.mode == "1" else 8))
+        return _PreparedImage(img.width, img.height, dpi, rotate, image_dict, zlib.compress(img.tobytes(), 6), smask)
+    except Exception:
+        return None
+
+# --- DOCUMENT SCANNING ---
+# Contour detection and perspective warp for photographed documents, shared by
+# Smart Scan (one photo, or a batch on a process pool) and manual corners.
+
+def _order_corners(pts):
+    """Orders 4 points as top-left, top-right, bottom-right, bottom-left."""
+    rect = np.zeros((4, 2), dtype="float32")
+    s = pts.sum(axis=1)
+    rect[0] = pts[np.argmin(s)] # TL
+    rect[2] = pts[np.argmax(s)] # BR
+    diff = np.diff(pts, axis=1)
+    rect[1] = pts[np.argmin(diff)] # TR
+    rect[3] = pts[np.argmax(diff)] # BL
+    return rect
+
+def _detect_document_corners(img):
+    """Ordered corners of the largest 4-point contour in a BGR image, or None."""
+    # 1. Resize for faster processing (maintain aspect ratio)
+    scale_height = 800.0
+    ratio = img.shape[0] / scale_height
+    w = int(img.shape[1] / ratio)
+    img_small = cv2.resize(img, (w, int(scale_height)))
+
+    # 2. Preprocessing (Grayscale + Blur)
+    gray = cv2.cvtColor(img_small, cv2.COLOR_BGR2GRAY)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+    # 3. Edge Detection (Canny), with a morphological closing to close small gaps in the contour
+    edged = cv2.Canny(gray, 75, 200)
+    kernel = np.ones((5, 5), np.uint8)
+    edged = cv2.morphologyEx(edged, cv2.MORPH_CLOSE, kernel)
+
+    # 4. Find Contours
+    cnts, _ = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    for c in sorted(cnts, key=cv2.contourArea, reverse=True)[:5]:
+        peri = cv2.arcLength(c, True)
+        approx = cv2.approxPolyDP(c, 0.02 * peri, True)
+        # If our approximated contour has 4 points, we can assume we found the document
+        if len(approx) == 4:
+            return _order_corners(approx.reshape(4, 2) * ratio)
+    return None
+
+def _warp_document(img, rect):
+    """Perspective-corrects the quadrilateral `rect` (ordered corners) to a flat page."""
+    (tl, tr, br, bl) = rect
+    maxWidth = max(int(np.hypot(*(br - bl))), int(np.hypot(*(tr - tl))))
+    maxHeight = max(int(np.hypot(*(tr - br))), int(np.hypot(*(tl - bl))))
+    dst = np.array([
+        [0, 0],
+        [maxWidth - 1, 0],
+        [maxWidth - 1, maxHeight - 1],
+        [0, maxHeight - 1]], dtype="float32")
+    M = cv2.getPerspectiveTransform(rect, dst)
+    return cv2.warpPerspective(img, M, (maxWidth, maxHeight))
+
+def _batch_scan_worker(task):
+    """
+    task = (image path, JPEG quality, output directory). Writes the warped JPEG
+    to a new file there and returns (its path, corners) or (None, None).
+    """
+    path, quality, out_dir = task
+    # imdecode rather than imread: imread cannot open non-ASCII paths on Windows
+    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    corners = _detect_document_corners(img) if img is not None else None
+    if corners is None:
+        return None, None
+    ok, jpeg = cv2.imencode(".jpg", _warp_document(img, corners), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        return None, None
+    fd, out_file = tempfile.mkstemp(suffix=".jpg", dir=out_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(jpeg.tobytes())
+    return out_file, corners.tolist()
+
+# --- PAGE CHUNK EXECUTOR ---
+# fitz page mutations (flattening and the like) run on chunks of pages in pool
+# workers. Each worker opens the source, keeps only its chunk, transforms it and
+# saves it to a temporary file; the new page content is then grafted back onto
+# the original page objects, so outlines, links and untouched pages survive as is.
+
+_CHUNK_MIN_PAGES = 25  # below this, opening the source per chunk costs more than it saves
+
+def _fitz_flatten(doc):
+    """Burns annotations and form fields into the page content."""
+    doc.bake()
+    for page in doc:
+        page.clean_contents()
+
+def _fitz_chunk_worker(task):
+    """task = (pdf_path, page indices, transform, out_path)."""
+    pdf_path, indices, transform, out_path = task
+    with fitz.open(pdf_path) as doc:
+        doc.select(indices)
+        transform(doc)
+        doc.save(out_path, garbage=1, deflate=True)
+    return out_path
+
+def _pages_with_annotations(pdf, ignore=("/Link",)):
+    """Cheap pre-scan: indices of pages with annotations other than `ignore` subtypes."""
+    return [i for i, page in enumerate(pdf.pages)
+            if any(annot.get("/Subtype") not in ignore for annot in page.obj.get("/Annots", []))]
+
+@contextlib.contextmanager
+def _transformed_pages(pdf, pdf_path, indices, transform, workers=None, keep_annots=("/Link",)):
+    """
+    Applies transform(fitz doc) to pages `indices` of `pdf` (opened from pdf_path)
+    and swaps their /Contents and /Resources for the results. Annotations other
+    than keep_annots are removed from those pages. Save `pdf` inside the block:
+    the chunk files back the copied streams until then.
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with contextlib.ExitStack() as parts:
+            if indices:
+                count = _worker_count(workers, len(indices))
+                size = max(_CHUNK_MIN_PAGES, -(-len(indices) // (count * 2)))
+                chunks = [indices[i:i + size] for i in range(0, len(indices), size)]
+                tasks = [(pdf_path, chunk, transform, os.path.join(temp_dir, f"chunk_{k}.pdf"))
+                         for k, chunk in enumerate(chunks)]
+                if len(tasks) == 1:
+                    paths = [_fitz_chunk_worker(tasks[0])]
+                else:
+                    with ProcessPoolExecutor(max_workers=_worker_count(workers, len(tasks))) as pool:
+                        paths = list(pool.map(_fitz_chunk_worker, tasks))
+                for chunk, path in zip(chunks, paths):
+                    part = parts.enter_context(pikepdf.open(path))
+                    for i, new_page in zip(chunk, part.pages):
+                        page = pdf.pages[i].obj
+                        for key in ("/Contents", "/Resources"):
+                            value = new_page.obj.get(key)
+                            if value is None:
+                                continue
+                            if not value.is_indirect:
+                                value = part.make_indirect(value)
+                            page[key] = pdf.copy_foreign(value)
+                        kept = [a for a in page.get("/Annots", []) if a.get("/Subtype") in keep_annots]
+                        if kept:
+                            page.Annots = pikepdf.Array(kept)
+                        elif "/Annots" in page:
+                            del page["/Annots"]
+            yield
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+# --- IMAGE RECOMPRESSION ---
+# Workers open the source once with pikepdf (_open_pdf_worker_init) and receive
+# only object numbers, so each image is decoded once, in the worker re-encoding it.
+
+def _image_display_sizes(pdf, pages=None):
+    """
+    Returns {xref: (width_pt, height_pt)}: the largest size each image is drawn at,
+    looking only at the given page numbers if `pages` is set. Only q/Q/cm/Do are
+    interpreted, so no image has to be decoded to find out where it lands.
+    """
+    sizes = {}
+
+    def walk(owner, resources, ctm, depth):
+        xobjects = resources.get("/XObject", {}) if resources is not None else {}
+        saved = []
+        for operands, op in pikepdf.parse_content_stream(owner, "q Q cm Do"):
+            op = str(op)
+            if op == "q":
+                saved.append(ctm)
+            elif op == "Q":
+                ctm = saved.pop() if saved else ctm
+            elif op == "cm":
+                ctm = pikepdf.Matrix(*operands) @ ctm
+            elif op == "Do":
+                xobj = xobjects.get(operands[0])
+                if xobj is None:
+                    continue
+                if xobj.get("/Subtype") == "/Image":
+                    # The CTM maps the unit square, so its row lengths are the drawn size
+                    w, h = abs(complex(ctm.a, ctm.b)), abs(complex(ctm.c, ctm.d))
+                    old = sizes.get(xobj.objgen[0], (0, 0))
+                    sizes[xobj.objgen[0]] = (max(old[0], w), max(old[1], h))
+                elif xobj.get("/Subtype") == "/Form" and depth < 8:
+                    matrix = pikepdf.Matrix(*xobj.get("/Matrix", [1, 0, 0, 1, 0, 0]))
+                    walk(xobj, xobj.get("/Resources", resources), matrix @ ctm, depth + 1)
+
+    for pno in (range(len(pdf.pages)) if pages is None else pages):
+        page = pdf.pages[pno]
+        try:
+            walk(page, page.obj.get("/Resources"), pikepdf.Matrix(), 0)
+        except pikepdf.PdfError:
+            continue  # unparseable content: its images keep their resolution
+    return sizes
+
+def _replace_with_jpeg(obj, jpeg, width, height, gray):
+    """Rewrites an image XObject in place as a DCT-encoded Gray/RGB image."""
+    obj.write(jpeg, filter=pikepdf.Name.DCTDecode)
+    obj.Width, obj.Height, obj.BitsPerComponent = width, height, 8
+    cs = obj.get("/ColorSpace")
+    # Keep ICC profiles with the right channel count; anything else
+    # (Indexed, CMYK, Separation) was converted to Gray/RGB by PIL
+    if not (isinstance(cs, pikepdf.Array) and cs[0] == "/ICCBased"
+            and int(cs[1].get("/N", 0)) == (1 if gray else 3)):
+        obj.ColorSpace = pikepdf.Name.DeviceGray if gray else pikepdf.Name.DeviceRGB
+
+def _is_jpeg_candidate(obj):
+    # Stencil masks, bitonal images, colour-key masks and /Decode arrays
+    # would not survive a JPEG round trip
+    return not (obj.get("/ImageMask", False) or obj.get("/BitsPerComponent", 8) < 8
+                or isinstance(obj.get("/Mask"), pikepdf.Array) or "/Decode" in obj)
+
+def _downsample_size(obj, drawn, dpi):
+    """Pixel size for an image drawn at `drawn` points so it lands at `dpi` (never upsampled)."""
+    w, h = int(obj.Width), int(obj.Height)
+    if drawn is None:
+        return w, h
+    effective = min(w * 72.0 / max(drawn[0], 1e-3), h * 72.0 / max(drawn[1], 1e-3))
+    scale = dpi / effective if effective > dpi * 1.1 else 1.0
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+def _open_pdf_worker_init(pdf_path):
+    _WORKER_STATE['pdf'] = pikepdf.open(pdf_path)
+
+def _recompress_image_worker(task):
+    """
+    task = (objgen, width, height, quality). Returns (objgen, jpeg, width, height,
+    gray, smask_data) or None when the image is left alone or would not shrink.
+    """
+    objgen, width, height, quality = task
+    result = _recompress_image(_WORKER_STATE['pdf'].get_object(objgen), width, height, quality)
+    return None if result is None else (objgen, *result)
+
+def _recompress_image(obj, width, height, quality, pil=None):
+    """
+    Returns (jpeg, width, height, gray, smask_data), or None to keep the original.
+    pil: pixels already decoded by the caller (the analyzer passes a crop).
+    """
+    try:
+        pil = pil or pikepdf.PdfImage(obj).as_pil_image()
+    except Exception:
+        return None  # unsupported filter or colour space: keep the original stream
+    gray = pil.mode in ("L", "LA", "1")
+    pil = pil.convert("L" if gray else "RGB")
+    if (width, height) != pil.size:
+        pil = pil.resize((width, height), Image.LANCZOS)
+    buf = io.BytesIO()
+    pil.save(buf, "JPEG", quality=quality, optimize=True)
+    jpeg = buf.getvalue()
+    if len(jpeg) >= len(obj.read_raw_bytes()):
+        return None
+
+    smask_data = None
+    smask = obj.get("/SMask")
+    if smask is not None:
+        try:
+            alpha = pikepdf.PdfImage(smask).as_pil_image().convert("L")
+        except Exception:
+            return None  # cannot resize the mask to match, so leave the pair untouched
+        if alpha.size != (width, height):
+            alpha = alpha.resize((width, height), Image.LANCZOS)
+        smask_data = zlib.compress(alpha.tobytes(), 9)
+    return jpeg, width, height, gray, smask_data
+
+# --- SCAN COMPRESSION ---
+# Scanned pages are classified as text, mixed or photo. Text pages become 1-bit
+# CCITT G4 images. Mixed pages are split into a G4 stencil (the ink, painted in
+# one colour) over a low-resolution JPEG background: mixed raster content (MRC).
+
+_SCAN_MIN_PIXELS = 1_000_000
+_MRC_BG_FACTOR = 3
+_SCAN_SOLID_AREA = 0.01  # share of the page in solid midtones that rules out a bitonal "text" page
+
+def _classify_scan(rgb):
+    """Returns "text", "mixed" or "photo" for an RGB page image (uint8 ndarray)."""
+    h, w = rgb.shape[:2]
+    scale = min(1.0, 1000.0 / max(h, w))
+    small = cv2.resize(rgb, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    # Divide out the paper (a max filter erases strokes) so phone shading is not a midtone
+    paper = cv2.blur(cv2.dilate(gray, np.ones((9, 9), np.uint8)), (15, 15))
+    flat = cv2.divide(gray, paper, scale=255)
+    midtones = np.mean((flat > 64) & (flat < 192))
+    hsv = cv2.cvtColor(small, cv2.COLOR_RGB2HSV)
+    colour = np.mean((hsv[..., 1] > 80) & (hsv[..., 2] > 60))
+    # Smooth photos flatten out too, so also look for large saturated midtone areas
+    if midtones > 0.35 or (colour > 0.2 and np.mean((gray > 64) & (gray < 192)) > 0.5):
+        return "photo"
+    # Dividing by the paper also flattens large smooth areas (shaded boxes, soft grayscale
+    # photos); solid midtones wider than a stroke on the raw gray must survive as background
+    solid = cv2.morphologyEx(((gray > 64) & (gray < 192)).astype(np.uint8), cv2.MORPH_OPEN, np.ones((7, 7), np.uint8))
+    if colour < 0.005 and midtones < 0.06 and np.mean(solid) < _SCAN_SOLID_AREA:
+        return "text"
+    return "mixed"
+
+def _g4_encode(ink):
+    """ink: bool ndarray (True = black). Returns raw CCITT G4 data for PDF (K=-1)."""
+    buf = io.BytesIO()
+    # A single strip keeps the TIFF payload one contiguous G4 stream
+    Image.fromarray(ink).save(buf, "TIFF", compression="group4", tiffinfo={278: ink.shape[0]})
+    tags = Image.open(io.BytesIO(buf.getvalue())).tag_v2
+    offset, length = tags[273][0], tags[279][0]
+    return buf.getvalue()[offset:offset + length]
+
+def _scan_compress_worker(task):
+    """
+    task = (objgen, quality). Returns (objgen, kind, width, height, g4, jpeg,
+    background_size, fill_rgb, gray) or None when the image would not shrink.
+    """
+    objgen, quality = task
+    result = _scan_compress_image(_WORKER_STATE['pdf'].get_object(objgen), quality)
+    return None if result is None else (objgen, *result)
+
+def _mask_objgens(pdf):
+    """Images other images use as /SMask or /Mask: they must stay single-channel images."""
+    masks = set()
+    for obj in pdf.objects:
+        if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image":
+            for key in ("/SMask", "/Mask"):
+                mask = obj.get(key)
+                if isinstance(mask, pikepdf.Stream):
+                    masks.add(mask.objgen)
+    return masks
+
+def _is_scan_candidate(obj, masks):
+    # A mask turned into a form (MRC) or an RGB JPEG is no longer a valid mask
+    return (not (obj.get("/ImageMask", False) or obj.get("/BitsPerComponent", 8) < 8
+                 or "/SMask" in obj or "/Mask" in obj or "/Decode" in obj or obj.objgen in masks)
+            and int(obj.Width) * int(obj.Height) >= _SCAN_MIN_PIXELS)
+
+def _scan_compress_image(obj, quality, pil=None):
+    """
+    Returns (kind, width, height, g4, jpeg, background_size, fill_rgb, gray), or None
+    to keep the original. pil: pixels already decoded by the caller.
+    """
+    try:
+        pil = pil or pikepdf.PdfImage(obj).as_pil_image()
+        gray = pil.mode == "L"
+        rgb = np.asarray(pil.convert("RGB"))
+    except Exception:
+        return None
+    h, w = rgb.shape[:2]
+    kind = _classify_scan(rgb)
+    g4 = jpeg = bg_size = fill = None
+    if kind == "photo":
+        buf = io.BytesIO()
+        (pil if gray else Image.fromarray(rgb)).save(buf, "JPEG", quality=quality, optimize=True)
+        jpeg = buf.getvalue()
+    else:
+        ink = _ink_mask(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)) > 0
+        g4 = _g4_encode(ink)
+        if kind == "mixed":
+            fill = tuple(float(c) / 255 for c in np.median(rgb[ink], axis=0)) if ink.any() else (0.0, 0.0, 0.0)
+            bg_size = (max(1, w // _MRC_BG_FACTOR), max(1, h // _MRC_BG_FACTOR))
+            bg = cv2.resize(rgb, bg_size, interpolation=cv2.INTER_AREA)
+            # Paint the text out of the background so it does not ghost behind the stencil
+            holes = cv2.resize(cv2.dilate(ink.astype(np.uint8), np.ones((5, 5), np.uint8)), bg_size,
+                               interpolation=cv2.INTER_AREA)
+            bg = cv2.inpaint(bg, (holes > 0).astype(np.uint8), 3, cv2.INPAINT_TELEA)
+            buf = io.BytesIO()
+            Image.fromarray(bg).save(buf, "JPEG", quality=quality, optimize=True)
+            jpeg = buf.getvalue()
+    if len(g4 or b"") + len(jpeg or b"") >= len(obj.read_raw_bytes()):
+        return None
+    return kind, w, h, g4, jpeg, bg_size, fill, gray
+
+def _g4_params(width, height):
+    return pikepdf.Dictionary(K=-1, Columns=width, Rows=height)
+
+def _replace_with_mrc(pdf, obj, width, height, g4, jpeg, bg_size, fill):
+    """Turns an image XObject into a Form XObject drawing background, then stencil."""
+    bg = pikepdf.Stream(pdf, jpeg)
+    bg.Type, bg.Subtype = pikepdf.Name.XObject, pikepdf.Name.Image
+    bg.Width, bg.Height, bg.BitsPerComponent = bg_size[0], bg_size[1], 8
+    bg.ColorSpace, bg.Filter = pikepdf.Name.DeviceRGB, pikepdf.Name.DCTDecode
+    fg = pikepdf.Stream(pdf, g4)
+    fg.Type, fg.Subtype = pikepdf.Name.XObject, pikepdf.Name.Image
+    fg.Width, fg.Height, fg.ImageMask = width, height, True
+    fg.Filter, fg.DecodeParms = pikepdf.Name.CCITTFaxDecode, _g4_params(width, height)
+
+    for key in list(obj.keys()):
+        if key != "/Length":
+            del obj[key]
+    # Images and forms both paint the unit square of the caller's CTM, so the
+    # form is a drop-in replacement wherever the image was used
+    obj.write(b"/BG Do %.3f %.3f %.3f rg /FG Do" % fill)
+    obj.Type, obj.Subtype = pikepdf.Name.XObject, pikepdf.Name.Form
+    obj.BBox = pikepdf.Array([0, 0, 1, 1])
+    obj.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(BG=bg, FG=fg))
+
+# --- GRAYSCALE ---
+# Colour is rewritten where it is specified (colour operators, colour spaces,
+# shadings, image samples) so text and vector art stay as they are. Content
+# streams and images are converted in pool workers; palettes, shadings and
+# annotation colours are small and handled in the parent.
+
+def _rgb_gray(r, g, b):
+    return 0.30 * r + 0.59 * g + 0.11 * b
+
+def _cmyk_gray(c, m, y, k):
+    return 1.0 - min(1.0, _rgb_gray(c, m, y) + k)
+
+def _to_gray(values, kind):
+    return _rgb_gray(*values) if kind == "rgb" else _cmyk_gray(*values)
+
+def _color_space_kind(cs, resources=None):
+    """"gray", "rgb" or "cmyk" for spaces that map to DeviceGray; None for the rest."""
+    if isinstance(cs, pikepdf.Name):
+        name = str(cs)
+        if name in ("/DeviceGray", "/G", "/CalGray"):
+            return "gray"
+        if name in ("/DeviceRGB", "/RGB", "/CalRGB"):
+            return "rgb"
+        if name in ("/DeviceCMYK", "/CMYK"):
+            return "cmyk"
+        spaces = resources.get("/ColorSpace") if resources is not None else None
+        named = spaces.get(cs) if isinstance(spaces, pikepdf.Dictionary) else None
+        return _color_space_kind(named) if named is not None else None
+    if isinstance(cs, pikepdf.Array) and len(cs):
+        family = str(cs[0])
+        if family == "/ICCBased":
+            return {1: "gray", 3: "rgb", 4: "cmyk"}.get(int(cs[1].get("/N", 0)))
+        if family in ("/CalGray", "/CalRGB"):
+            return "gray" if family == "/CalGray" else "rgb"
+    return None
+
+def _page_resources(page):
+    """The /Resources a page draws with, following the page tree when inherited."""
+    node = page
+    while node is not None:
+        if "/Resources" in node:
+            return node.Resources
+        node = node.get("/Parent")
+    return None
+
+def _gray_content(owner, resources):
+    """
+    Returns (content with colours in gray or None if unchanged, whether it has
+    inline images). Inline images are left to the parent, see _gray_inline_images.
+    """
+    instructions = pikepdf.parse_content_stream(owner)
+    fill = stroke = "gray"
+    saved, changed, inline = [], False, False
+    for i, inst in enumerate(instructions):
+        if isinstance(inst, pikepdf.ContentStreamInlineImage):
+            inline = True
+            continue
+        op = str(inst.operator)
+        operands = inst.operands
+        if op == "q":
+            saved.append((fill, stroke))
+        elif op == "Q":
+            fill, stroke = saved.pop() if saved else (fill, stroke)
+        elif op in ("rg", "RG", "k", "K") and len(operands) in (3, 4):
+            gray = _to_gray([float(v) for v in operands], "rgb" if op in ("rg", "RG") else "cmyk")
+            instructions[i] = pikepdf.ContentStreamInstruction([round(gray, 4)], pikepdf.Operator("g" if op.islower() else "G"))
+            changed = True
+        elif op in ("cs", "CS") and operands:
+            kind = _color_space_kind(operands[0], resources)
+            if kind in ("rgb", "cmyk"):
+                instructions[i] = pikepdf.ContentStreamInstruction([pikepdf.Name.DeviceGray], inst.operator)
+                changed = True
+            if op == "cs":
+                fill = kind
+            else:
+                stroke = kind
+        elif op in ("sc", "scn", "SC", "SCN"):
+            kind = fill if op.islower() else stroke
+            if kind in ("rgb", "cmyk") and len(operands) == (3 if kind == "rgb" else 4):
+                gray = _to_gray([float(v) for v in operands], kind)
+                instructions[i] = pikepdf.ContentStreamInstruction([round(gray, 4)], inst.operator)
+                changed = True
+    return pikepdf.unparse_content_stream(instructions) if changed else None, inline
+
+def _gray_image(obj):
+    """Returns (data, filter name) for an RGB/CMYK image as 8-bit gray, or None to keep it."""
+    if (obj.get("/ImageMask", False) or "/Decode" in obj or isinstance(obj.get("/Mask"), pikepdf.Array)
+            or _color_space_kind(obj.get("/ColorSpace")) not in ("rgb", "cmyk")):
+        return None
+    try:
+        pil = pikepdf.PdfImage(obj).as_pil_image().convert("L")
+    except Exception:
+        return None  # unsupported filter: keep the colour original
+    if obj.get("/Filter") == "/DCTDecode":
+        buf = io.BytesIO()
+        pil.save(buf, "JPEG", quality=90, optimize=True)
+        return buf.getvalue(), "/DCTDecode"
+    return zlib.compress(pil.tobytes(), 6), "/FlateDecode"
+
+def _set_gray_image(obj, data, filter_):
+    obj.write(data, filter=pikepdf.Name(filter_))
+    obj.ColorSpace, obj.BitsPerComponent = pikepdf.Name.DeviceGray, 8
+    if "/DecodeParms" in obj:
+        del obj["/DecodeParms"]
+
+def _grayscale_worker(task):
+    """
+    task = ("page", page index) or ("form", objgen) for content, ("image", objgen).
+    Returns (task, data, filter, has inline images) or None when nothing changes.
+    """
+    kind, key = task
+    pdf = _WORKER_STATE['pdf']
+    try:
+        if kind == "image":
+            result = _gray_image(pdf.get_object(key))
+            return None if result is None else (task, *result, False)
+        owner = pdf.pages[key] if kind == "page" else pdf.get_object(key)
+        resources = _page_resources(owner.obj) if kind == "page" else owner.get("/Resources")
+        data, inline = _gray_content(owner, resources)
+    except pikepdf.PdfError:
+        return None  # unparseable content keeps its colours
+    return None if data is None and not inline else (task, data, None, inline)
+
+def _gray_inline_images(owner):
+    """
+    Moves the inline images of a page or form (a pikepdf.Page) into image
+    XObjects and converts those, in the parent: inline images are small and
+    rare, and the content has to be rewritten around them anyway.
+    """
+    if "/Resources" not in owner.obj and owner.obj.get("/Type") != "/Page":
+        owner.obj.Resources = pikepdf.Dictionary()  # qpdf only adds them to pages
+    owner.externalize_inline_images(shallow=True)
+    resources = owner.obj.Resources
+    for obj in resources.get("/XObject", {}).values():
+        if not isinstance(obj, pikepdf.Stream) or obj.get("/Subtype") != "/Image":
+            continue
+        cs = obj.get("/ColorSpace")
+        spaces = resources.get("/ColorSpace")
+        if isinstance(cs, pikepdf.Name) and isinstance(spaces, pikepdf.Dictionary) and cs in spaces:
+            # An inline image may name a resource; an image XObject may not
+            cs = obj.ColorSpace = spaces[cs]
+        if isinstance(cs, pikepdf.Array) and len(cs) == 4 and cs[0] == "/Indexed":
+            _gray_indexed(cs)
+        else:
+            result = _gray_image(obj)
+            if result is not None:
+                _set_gray_image(obj, *result)
+
+def _gray_indexed(cs):
+    """Rewrites an [/Indexed base hival lookup] palette onto DeviceGray, in place."""
+    kind = _color_space_kind(cs[1])
+    if kind not in ("rgb", "cmyk"):
+        return
+    lookup = cs[3]
+    lookup = lookup.read_bytes() if isinstance(lookup, pikepdf.Stream) else bytes(lookup)
+    n = 3 if kind == "rgb" else 4
+    table = bytes(round(_to_gray([v / 255 for v in lookup[i:i + n]], kind) * 255)
+                  for i in range(0, len(lookup) - n + 1, n))
+    cs[1] = pikepdf.Name.DeviceGray
+    cs[3] = pikepdf.String(table)
+
+def _gray_shading(shading):
+    """Axial/radial shadings whose function is exponential (or stitched exponentials)."""
+    kind = _color_space_kind(shading.get("/ColorSpace"))
+    if kind not in ("rgb", "cmyk"):
+        return
+    func = shading.get("/Function")
+    funcs = list(func.get("/Functions", [])) if isinstance(func, pikepdf.Dictionary) and func.get("/FunctionType") == 3 else [func]
+    if not all(isinstance(f, pikepdf.Dictionary) and f.get("/FunctionType") == 2 for f in funcs):
+        return
+    n = 3 if kind == "rgb" else 4
+    for f in funcs:
+        for key, default in (("/C0", [0.0] * n), ("/C1", [1.0] * n)):
+            values = f.get(key, default)
+            if len(values) == n:  # not already converted through another shading
+                f[key] = pikepdf.Array([_to_gray([float(v) for v in values], kind)])
+        if "/Range" in f:
+            f.Range = pikepdf.Array([0, 1])
+    if "/Background" in shading:
+        shading.Background = pikepdf.Array([_to_gray([float(v) for v in shading.Background], kind)])
+    shading.ColorSpace = pikepdf.Name.DeviceGray
+
+def _gray_resources(resources):
+    """Palettes and shadings named in a resource dictionary."""
+    if not isinstance(resources, pikepdf.Dictionary):
+        return
+    for cs in resources.get("/ColorSpace", {}).values():
+        if isinstance(cs, pikepdf.Array) and len(cs) == 4 and cs[0] == "/Indexed":
+            _gray_indexed(cs)
+    for shading in resources.get("/Shading", {}).values():
+        if isinstance(shading, pikepdf.Dictionary):
+            _gray_shading(shading)
+    for pattern in resources.get("/Pattern", {}).values():
+        if isinstance(pattern.get("/Shading"), pikepdf.Dictionary):
+            _gray_shading(pattern.Shading)
+
+# --- RESOURCE PRUNING ---
+# A resource entry is kept if any content stream drawing with that resource
+# dictionary names it. Shared (indirect) sub-dictionaries are judged on the
+# union of all their users, and anything unparseable keeps everything.
+
+_RESOURCE_OPERATORS = {
+    "Do": "/XObject", "Tf": "/Font", "gs": "/ExtGState", "sh": "/Shading",
+    "cs": "/ColorSpace", "CS": "/ColorSpace", "scn": "/Pattern", "SCN": "/Pattern",
+    "BDC": "/Properties", "DP": "/Properties",
+}
+_RESOURCE_CATEGORIES = sorted(set(_RESOURCE_OPERATORS.values()))
+
+def _used_resource_names(owner):
+    """{category: {name, ...}} named by a content stream, None for a category to keep whole; None if unparseable."""
+    try:
+        instructions = pikepdf.parse_content_stream(owner)
+    except pikepdf.PdfError:
+        return None
+    used = {}
+    for inst in instructions:
+        if isinstance(inst, pikepdf.ContentStreamInlineImage):
+            used["/ColorSpace"] = None  # inline images may name a colour space in their header
+            continue
+        category = _RESOURCE_OPERATORS.get(str(inst.operator))
+        if category is None or used.get(category, ()) is None:
+            continue
+        # Pattern and marked-content names are the last / second operand
+        operand = inst.operands[-1] if category == "/Pattern" else inst.operands[1] if category == "/Properties" else inst.operands[0]
+        if isinstance(operand, pikepdf.Name):
+            used.setdefault(category, set()).add(str(operand))
+    return used
+
+def _prune_unused_resources(pdf):
+    """Deletes resource entries that no page, form, pattern or appearance stream names."""
+    usage, subdicts, visited = {}, {}, set()
+
+    def record(key, sub, names):
+        prev = usage.get(key, set())
+        usage[key] = None if names is None or prev is None else prev | names
+        subdicts[key] = sub
+
+    def visit(owner, resources, res_key):
+        if not isinstance(resources, pikepdf.Dictionary):
+            return
+        used = _used_resource_names(owner)
+        for category in _RESOURCE_CATEGORIES:
+            sub = resources.get(category)
+            if isinstance(sub, pikepdf.Dictionary):
+                key = sub.objgen if sub.is_indirect else (res_key, category)
+                record(key, sub, None if used is None else used.get(category, set()))
+        # Follow the forms and tiling patterns this stream draws (all of them if unparseable)
+        for category in ("/XObject", "/Pattern"):
+            sub = resources.get(category)
+            if not isinstance(sub, pikepdf.Dictionary):
+                continue
+            names = sub.keys() if used is None or used.get(category, ()) is None else used.get(category, ())
+            for name in names:
+                child = sub.get(name)
+                if isinstance(child, pikepdf.Stream) and child.objgen not in visited and (
+                        child.get("/Subtype") == "/Form" or child.get("/PatternType") == 1):
+                    visited.add(child.objgen)
+                    child_res = child.get("/Resources")
+                    if child_res is None:  # legacy forms inherit the caller's resources
+                        visit(child, resources, res_key)
+                    else:
+                        visit(child, child_res, child_res.objgen if child_res.is_indirect else child.objgen)
+
+    for page in pdf.pages:
+        node = page.obj
+        while node is not None and "/Resources" not in node:
+            node = node.get("/Parent")  # inherited from the page tree
+        resources = node.Resources if node is not None else None
+        if resources is not None:
+            visit(page, resources, resources.objgen if resources.is_indirect else node.objgen)
+        for annot in page.obj.get("/Annots", []):
+            for ap in (annot.get("/AP") or {}).values():
+                for stream in ([ap] if isinstance(ap, pikepdf.Stream) else ap.values() if isinstance(ap, pikepdf.Dictionary) else []):
+                    if isinstance(stream, pikepdf.Stream) and stream.objgen not in visited:
+                        visited.add(stream.objgen)
+                        res = stream.get("/Resources")
+                        visit(stream, res, res.objgen if res is not None and res.is_indirect else stream.objgen)
+
+    # Form fields draw from the AcroForm default resources; never prune those
+    dr = pdf.Root.get("/AcroForm", {}).get("/DR")
+    if isinstance(dr, pikepdf.Dictionary):
+        for category in _RESOURCE_CATEGORIES:
+            sub = dr.get(category)
+            if isinstance(sub, pikepdf.Dictionary) and sub.is_indirect:
+                usage[sub.objgen] = None
+
+    removed = 0
+    for key, names in usage.items():
+        if names is None:
+            continue
+        sub = subdicts[key]
+        for name in list(sub.keys()):
+            if name not in names:
+                del sub[name]
+                removed += 1
+    return removed
+
+def _save_optimized(pdf, output_path, subset_fonts=True):
+    """
+    Saves an open pikepdf document with the lossless optimize pass: unused resources
+    dropped, fonts subset, identical objects merged.
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        _prune_unused_resources(pdf)
+        pdf.save(tmp)
+        with fitz.open(tmp) as doc:
+            if subset_fonts:
+                doc.subset_fonts()  # needs fontTools; identical font files are subset together
+            # garbage=4 drops the now-unreferenced objects and merges duplicate streams
+            doc.save(output_path, garbage=4, deflate=True, use_objstms=1)
+    finally:
+        os.remove(tmp)
+
+# --- COMPRESSION ANALYSIS ---
+# Byte counts come from each stream's /Length, so no stream is decoded; only a
+# small sample of images is re-encoded to predict what the image levels save.
+
+_ANALYSIS_SAMPLE = 4
+_ANALYSIS_BUDGET = 0.5  # seconds of sample re-encoding before estimates settle for what they have
+_ANALYSIS_PIXELS = 2_000_000  # samples are cut to a central band this big; output scales with area
+
+# Target-size search: (image dpi, JPEG quality) from gentlest to harshest
+_TARGET_STEPS = [(200, 80), (150, 75), (150, 60), (120, 60), (110, 50), (96, 45), (72, 40), (60, 30), (50, 25)]
+_TARGET_MARGIN = 0.95  # aim a little under the limit to absorb prediction error
+_SUBSET_KEEP = 0.25  # share of a fully embedded font program left after subsetting to the glyphs used
+
+def _filter_name(obj):
+    f = obj.get("/Filter")
+    if isinstance(f, pikepdf.Array):
+        f = f[len(f) - 1] if len(f) else None  # the innermost filter is the image codec
+    return str(f)[1:] if f is not None else "Uncompressed"
+
+def _reachable_objgens(pdf):
+    """Object ids reachable from the trailer: everything a rewrite would keep."""
+    seen = set()
+    stack = [pdf.trailer]
+    containers = (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream)
+    while stack:
+        obj = stack.pop()
+        for child in (obj if isinstance(obj, pikepdf.Array) else obj.values()):
+            if not isinstance(child, containers):
+                continue
+            if child.is_indirect:
+                if child.objgen in seen:
+                    continue
+                seen.add(child.objgen)
+            stack.append(child)
+    return seen
+
+def _stream_category(obj, content_ids):
+    subtype, kind = obj.get("/Subtype"), obj.get("/Type")
+    if subtype == "/Image":
+        return "Images (%s)" % _filter_name(obj)
+    if "/Length1" in obj or subtype in ("/Type1C", "/CIDFontType0C", "/OpenType"):
+        return "Fonts"
+    if subtype == "/Form" or obj.objgen in content_ids:
+        return "Content streams"
+    if kind == "/Metadata":
+        return "Metadata"
+    if "/N" in obj:
+        return "Colour profiles"  # ICCBased colour space streams
+    if kind in ("/ObjStm", "/XRef"):
+        return "Object & xref streams"
+    return "Other streams"
+
+def _spread_sample(items, n):
+    """Up to n items evenly spaced through `items` sorted by size, so both ends are represented."""
+    items = sorted(items, key=lambda item: item[1])
+    if len(items) <= n:
+        return items
+    return [items[round(i * (len(items) - 1) / (n - 1))] for i in range(n)] if n > 1 else items[-1:]
+
+def _sampled_ratio(samples, encode, deadline):
+    """
+    Output/input byte ratio of `encode(obj)` (None meaning unchanged) over the
+    samples, stopping early once `deadline` (time.monotonic) has passed.
+    """
+    before = after = 0
+    for obj, length in samples:
+        if before and time.monotonic() > deadline:
+            break
+        before += length
+        out = encode(obj)
+        after += length if out is None else min(length, out)
+    return after / before if before else 1.0
+
+def _flate_ratio(samples, probe=256 * 1024):
+    """Deflate ratio of the first `probe` bytes of each uncompressed sample stream."""
+    raw = b"".join(obj.read_raw_bytes()[:probe] for obj, _ in samples)
+    return len(zlib.compress(raw, 6)) / len(raw) if raw else 1.0
+
+class _SizeModel:
+    """
+    Byte breakdown of an open PDF plus lazily decoded image samples. The analyzer
+    and the target-size search both predict output sizes from it.
+    """
+
+    def __init__(self, pdf, file_size, sample_size=_ANALYSIS_SAMPLE):
+        self.file_size = file_size
+        content_ids, image_pages = set(), {}
+        for pno, page in enumerate(pdf.pages):
+            contents = page.obj.get("/Contents")
+            for c in (contents if isinstance(contents, pikepdf.Array) else [contents] if contents is not None else []):
+                content_ids.add(c.objgen)
+            for xobj in page.obj.get("/Resources", {}).get("/XObject", {}).values():
+                image_pages.setdefault(xobj.objgen, pno)
+        reachable = _reachable_objgens(pdf)
+        masks = _mask_objgens(pdf)
+
+        self.categories = {}
+        self.jpeg_candidates, self.scan_candidates, self.plain = [], [], []
+        self.objects = stream_bytes = self.uncompressed_content = 0
+        same_length = {}
+        for obj in pdf.objects:
+            self.objects += 1
+            if not isinstance(obj, pikepdf.Stream):
+                continue
+            length = int(obj.get("/Length", 0))
+            stream_bytes += length
+            if obj.objgen not in reachable:
+                name = "Unused objects"
+            else:
+                same_length.setdefault(length, []).append(obj)
+                name = _stream_category(obj, content_ids)
+                if name.startswith("Images"):
+                    if _is_jpeg_candidate(obj):
+                        self.jpeg_candidates.append((obj, length))
+                    if _is_scan_candidate(obj, masks):
+                        self.scan_candidates.append((obj, length))
+                if "/Filter" not in obj:
+                    self.plain.append((obj, length))
+                    if name == "Content streams":
+                        self.uncompressed_content += length
+            self.categories[name] = self.categories.get(name, 0) + length
+        self.structure = max(0, file_size - stream_bytes)
+        self.categories["Structure (dictionaries, xref)"] = self.structure
+        self.unused = self.categories.get("Unused objects", 0)
+
+        # Only the sampled images are decoded; their ratio is applied to the rest
+        self.jpeg_sample = _spread_sample(self.jpeg_candidates, sample_size)
+        self.scan_sample = _spread_sample(self.scan_candidates, sample_size)
+        pages = sorted({image_pages[obj.objgen] for obj, _ in self.jpeg_sample if obj.objgen in image_pages})
+        self.sizes = _image_display_sizes(pdf, pages) if pages else {}
+        self.deflated = 1 - _flate_ratio(_spread_sample(self.plain, sample_size))
+        self.optimizable = self._optimize_savings(pdf, same_length)
+        self._bands = {}
+
+    def _optimize_savings(self, pdf, same_length):
+        """
+        Bytes optimize_pdf takes off beyond _base: copies of identical streams (only
+        streams of equal length are hashed) and the unused glyphs of fonts embedded in full.
+        """
+        seen, duplicates, saved = set(), set(), 0
+        for group in same_length.values():
+            if len(group) < 2:
+                continue
+            for obj in group:
+                digest = hashlib.sha256(obj.read_raw_bytes()).digest()
+                if digest in seen:
+                    duplicates.add(obj.objgen)
+                    saved += int(obj.get("/Length", 0))
+                seen.add(digest)
+        for obj in pdf.objects:
+            if not isinstance(obj, pikepdf.Dictionary) or obj.get("/Type") != "/FontDescriptor":
+                continue
+            # Subset fonts are tagged "ABCDEF+Name"; there is nothing left to drop from those
+            if str(obj.get("/FontName", ""))[7:8] == "+":
+                continue
+            for key in ("/FontFile", "/FontFile2", "/FontFile3"):
+                font_file = obj.get(key)
+                if isinstance(font_file, pikepdf.Stream) and font_file.objgen not in duplicates:
+                    # _base already counts the deflate savings of unfiltered programs
+                    length = int(font_file.get("/Length", 0))
+                    if "/Filter" not in font_file:
+                        length *= 1 - self.deflated
+                    saved += (1 - _SUBSET_KEEP) * length
+        return saved
+
+    def _band(self, obj):
+        """Decodes a sample once and keeps a central band of it, with the band's share of the rows."""
+        if obj.objgen not in self._bands:
+            try:
+                pil = pikepdf.PdfImage(obj).as_pil_image()
+            except Exception:
+                self._bands[obj.objgen] = (None, 1.0)
+            else:
+                rows = max(1, min(pil.height, _ANALYSIS_PIXELS // max(1, pil.width)))
+                top = (pil.height - rows) // 2
+                self._bands[obj.objgen] = (pil.crop((0, top, pil.width, top + rows)), rows / pil.height)
+        return self._bands[obj.objgen]
+
+    def _jpeg_bytes(self, obj, dpi, quality):
+        pil, frac = self._band(obj)
+        if pil is None:
+            return None
+        w, h = _downsample_size(obj, self.sizes.get(obj.objgen[0]), dpi)
+        result = _recompress_image(obj, w, max(1, round(h * frac)), quality, pil)
+        return None if result is None else (len(result[0]) + len(result[4] or b"")) / frac
+
+    def _scan_bytes(self, obj, quality):
+        pil, frac = self._band(obj)
+        result = None if pil is None else _scan_compress_image(obj, quality, pil)
+        return None if result is None else (len(result[3] or b"") + len(result[4] or b"")) / frac
+
+    def _base(self, candidates):
+        """
+        Size once rewritten, before its image encoder runs on `candidates`. Every
+        level keeps only reachable objects; pikepdf levels also deflate every
+        stream and pack dictionaries into object streams (roughly 40% off the structure).
+        """
+        taken = {obj.objgen for obj, _ in candidates}
+        plain = sum(length for obj, length in self.plain if obj.objgen not in taken)
+        return self.file_size - self.unused - 0.4 * self.structure - self.deflated * plain
+
+    def predict_low(self):
+        return self.file_size - self.unused - self.deflated * self.uncompressed_content
+
+    def predict_medium(self):
+        return self._base([]) - self.optimizable
+
+    def predict_jpeg(self, dpi, quality, deadline=float("inf")):
+        total = sum(length for _, length in self.jpeg_candidates)
+        ratio = _sampled_ratio(self.jpeg_sample, lambda obj: self._jpeg_bytes(obj, dpi, quality), deadline)
+        return self._base(self.jpeg_candidates) - self.optimizable - total * (1 - ratio)
+
+    def predict_scanned(self, quality, deadline=float("inf")):
+        total = sum(length for _, length in self.scan_candidates)
+        ratio = _sampled_ratio(self.scan_sample, lambda obj: self._scan_bytes(obj, quality), deadline)
+        return self._base(self.scan_candidates) - total * (1 - ratio)
+
+# --- OUTPUT OPTIONS ---
+# One place for how every PDF the engine writes is serialized. Writers are
+# wrapped with _pdf_writer; the outermost call rewrites its output once, and
+# only when the options differ from the defaults.
+
+_OBJECT_STREAM_MODES = {"preserve": pikepdf.ObjectStreamMode.preserve,
+                        "generate": pikepdf.ObjectStreamMode.generate,
+                        "disable": pikepdf.ObjectStreamMode.disable}
+
+class OutputOptions(namedtuple("OutputOptions", "linearize object_streams compression")):
+    """
+    linearize: "fast web view", page 1 displays before the download ends.
+    object_streams: "preserve", "generate" (smaller) or "disable" (old readers).
+    compression: "default", "max" (recompress all Flate at level 9) or "none".
+    """
+    __slots__ = ()
+
+    def __new__(cls, linearize=False, object_streams="preserve", compression="default"):
+        if object_streams not in _OBJECT_STREAM_MODES:
+            raise ValueError(f"Unknown object stream mode '{object_streams}'.")
+        if compression not in ("default", "max", "none"):
+            raise ValueError(f"Unknown compression level '{compression}'.")
+        return super().__new__(cls, bool(linearize), object_streams, compression)
+
+_OUTPUT_STATE = threading.local()
+
+def _apply_output_options(path, options):
+    """Rewrites the PDF at path per options; a no-op for the defaults."""
+    if options == OutputOptions() or not os.path.isfile(path):
+        return
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        if options.compression == "max":
+            _deflate_max(pdf)
+        pdf.save(path, linearize=options.linearize,
+                 object_stream_mode=_OBJECT_STREAM_MODES[options.object_streams],
+                 compress_streams=options.compression != "none",
+                 stream_decode_level=pikepdf.StreamDecodeLevel.generalized if options.compression == "none" else None)
+
+def _deflate_max(pdf):
+    """
+    Re-deflates plain and Flate-only streams at level 9, keeping whichever is
+    smaller. Done per stream here because pikepdf's level is process-wide
+    state that concurrent saves on other threads would pick up.
+    """
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream) or obj.get("/Filter", pikepdf.Name.FlateDecode) != "/FlateDecode":
+            continue
+        try:
+            data = obj.read_bytes()
+        except pikepdf.PdfError:
+            continue  # undecodable: leave the stream as it is
+        packed = zlib.compress(data, 9)
+        if "/Filter" not in obj or len(packed) < len(obj.read_raw_bytes()):
+            obj.write(packed, filter=pikepdf.Name.FlateDecode)
+
+def _pdf_writer(func):
+    """
+    Decorates a PDFEngine method with an output_path parameter, or one returning
+    the list of files it wrote (split_pdf): once the outermost writer returns,
+    PDFEngine.output_options are applied to its output(s). Writers called by
+    other writers (or inside deferred_output_options) skip it.
+    """
+    signature = inspect.signature(func)
+    single = "output_path" in signature.parameters
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_OUTPUT_STATE, "depth", 0)
+        _OUTPUT_STATE.depth = depth + 1
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            _OUTPUT_STATE.depth = depth
+        if depth == 0:
+            paths = [signature.bind(*args, **kwargs).arguments["output_path"]] if single else result
+            for path in paths:
+                _apply_output_options(path, PDFEngine.output_options)
+        return result
+    return wrapper
+
+# --- INCREMENTAL UPDATES ---
+# Small edits are appended to the file as an update section (changed objects
+# plus a new xref) instead of rewriting every object.
+
+def _save_incremental(input_path, output_path, edit):
+    """
+    Applies edit(doc) to a fitz document and saves it as an incremental update.
+    In place (output_path == input_path) the cost is the size of the edit;
+    otherwise the original is first copied byte for byte. Files fitz cannot
+    update incrementally (e.g. repaired on open) are rewritten in full.
+    """
+    if os.path.abspath(input_path) != os.path.abspath(output_path):
+        shutil.copyfile(input_path, output_path)
+    with fitz.open(output_path) as doc:
+        if doc.can_save_incrementally():
+            edit(doc)
+            doc.saveIncr()
+            return
+    with fitz.open(input_path) as doc:
+        edit(doc)
+        fd, temp_path = tempfile.mkstemp(suffix=".pdf", dir=os.path.dirname(os.path.abspath(output_path)))
+        os.close(fd)
+        doc.save(temp_path, garbage=1, deflate=True)
+    os.replace(temp_path, output_path)
+
+def _rewrite_metadata(input_path, output_path, metadata=None):
+    """
+    Rewrites the whole file with Info entries set or, where empty, removed
+    (metadata=None removes the Info dictionary). XMP metadata is dropped, as it
+    would repeat the old values, and a full rewrite leaves no earlier revision
+    holding them.
+    """
+    with pikepdf.open(input_path, allow_overwriting_input=True) as pdf:
+        if "/Metadata" in pdf.Root:
+            del pdf.Root.Metadata
+        if metadata is None:
+            if "/Info" in pdf.trailer:
+                del pdf.trailer.Info
+        else:
+            info = pdf.docinfo
+            for key, value in metadata.items():
+                if value:
+                    info[key] = pikepdf.String(value)
+                elif key in info:
+                    del info[key]
+        pdf.save(output_path)
+
+# --- PAGE ORDER ---
+
+def _copy_page(pdf, page):
+    """
+    A new page object sharing page's contents and resources. Annotations are
+    copied too, each pointing back (/P) at the copy, with popups relinked to
+    their copied markup, since an annotation belongs to a single page.
+    """
+    copy = pdf.make_indirect(pikepdf.Dictionary(page))
+    if "/Annots" not in page:
+        return copy
+    copies = {}
+    for annot in page.Annots:
+        if isinstance(annot, pikepdf.Dictionary) and annot.is_indirect:
+            copies[annot.objgen] = pdf.make_indirect(pikepdf.Dictionary(annot))
+    for annot in copies.values():
+        if "/P" in annot:
+            annot.P = copy
+        for key in ("/Popup", "/Parent"):
+            target = annot.get(key)
+            if target is not None and target.is_indirect and target.objgen in copies:
+                annot[key] = copies[target.objgen]
+    copy.Annots = pikepdf.Array([copies.get(a.objgen, a) if a.is_indirect else a
+                                 for a in page.Annots])
+    return copy
+
 class PDFEngine:
+    # Applied to the output of every writer; see OutputOptions
+    output_options = OutputOptions()
+
+    @staticmethod
+    def apply_output_options(path, options=None):
+        """Serializes an existing PDF per options (default: PDFEngine.output_options)."""
+        _apply_output_options(path, options or PDFEngine.output_options)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def deferred_output_options():
+        """
+        Within the block writers leave their outputs as written, e.g. for the
+        intermediate files of a pipeline; call apply_output_options on the result.
+        """
+        depth = getattr(_OUTPUT_STATE, "depth", 0)
+        _OUTPUT_STATE.depth = depth + 1
+        try:
+            yield
+        finally:
+            _OUTPUT_STATE.depth = depth
+
     # --- EXISTING FEATURES ---
     @staticmethod
+    @_pdf_writer
     def merge_pdfs(file_list, output_path):
-        merger = PdfWriter()
-        for pdf in file_list:
-            merger.append(pdf)
-        merger.write(output_path)
-        merger.close()
+        """
+        Streams each input into the output in turn (only one is open at a time);
+        identical streams such as shared fonts and logos are stored once.
+        """
+        with open(output_path, "wb") as f, _StreamingPdfWriter(f) as writer:
+            for path in file_list:
+                with pikepdf.open(path) as pdf:
+                    pages = writer.copy_pages(pdf)
+                with fitz.open(path) as doc:
+                    toc = doc.get_toc()
+                writer.add_outline([(level, title, pages[pno - 1]) for level, title, pno in toc if 1 <= pno <= len(pages)])
 
     @staticmethod
-    def split_pdf(input_path, output_folder, mode="all", page_range=None):
-        reader = PdfReader(input_path)
+    @_pdf_writer
+    def split_pdf(input_path, output_folder, mode="all", page_range=None, pages_per_part=None,
+                  max_bytes=None, workers=None):
+        """
+        Modes: "all" (one file per page), "extract" (selected pages into one file),
+        "every_n" (pages_per_part pages per file), "size" (parts of roughly
+        max_bytes each) and "bookmarks" (one file per top-level outline entry).
+        page_range narrows the pages for every mode but "bookmarks". Parts are
+        written in parallel by workers that each open the source once.
+        Returns the output paths.
+        """
         base_name = os.path.splitext(os.path.basename(input_path))[0]
-        total_pages = len(reader.pages)
-        
-        selected_indices = []
-        if page_range:
-            try:
-                parts = [p.strip() for p in page_range.split(',')]
-                for p in parts:
-                    if '-' in p:
-                        start, end = map(int, p.split('-'))
-                        selected_indices.extend(range(start-1, end))
-                    else:
-                        selected_indices.append(int(p)-1)
-                selected_indices = [i for i in selected_indices if 0 <= i < total_pages]
-            except: pass 
-        else:
-            selected_indices = list(range(total_pages))
+        with pikepdf.open(input_path) as pdf:
+            total_pages = len(pdf.pages)
+            selected = _parse_page_range(page_range, total_pages) if page_range else list(range(total_pages))
 
-        if mode == "all":
-            for i in selected_indices:
-                writer = PdfWriter()
-                writer.add_page(reader.pages[i])
-                out_file = os.path.join(output_folder, f"{base_name}_page_{i+1}.pdf")
-                with open(out_file, "wb") as f:
-                    writer.write(f)
-        elif mode == "extract":
-            writer = PdfWriter()
-            for i in selected_indices:
-                writer.add_page(reader.pages[i])
-            out_file = os.path.join(output_folder, f"{base_name}_extracted.pdf")
-            with open(out_file, "wb") as f:
-                writer.write(f)
-    @staticmethod
-    def extract_images(pdf_path, output_dir):
-        """Feature 18: Extract raw images from PDF"""
-        doc = fitz.open(pdf_path)
+            if mode == "all":
+                parts = [(f"{base_name}_page_{i+1}.pdf", [i]) for i in selected]
+            elif mode == "extract":
+                parts = [(f"{base_name}_extracted.pdf", selected)]
+            elif mode == "every_n":
+                if not pages_per_part or pages_per_part < 1:
+                    raise ValueError("Pages per part must be at least 1.")
+                chunks = [selected[i:i + pages_per_part] for i in range(0, len(selected), pages_per_part)]
+                parts = [(f"{base_name}_pages_{c[0]+1}-{c[-1]+1}.pdf", c) for c in chunks]
+            elif mode == "size":
+                if not max_bytes or max_bytes <= 0:
+                    raise ValueError("Maximum part size must be positive.")
+                chunks, current, used, size = [], [], set(), 0
+                for i, streams in zip(selected, _page_stream_sizes(pdf, selected)):
+                    extra = _PAGE_OVERHEAD + sum(n for key, n in streams.items() if key not in used)
+                    if current and size + extra > max_bytes:
+                        chunks.append(current)
+                        current, used, size = [], set(), 0
+                        extra = _PAGE_OVERHEAD + sum(streams.values())
+                    current.append(i)
+                    used.update(streams)
+                    size += extra
+                if current:
+                    chunks.append(current)
+                parts = [(f"{base_name}_part_{k+1:03d}.pdf", c) for k, c in enumerate(chunks)]
+            elif mode == "bookmarks":
+                with fitz.open(input_path) as doc:
+                    starts = [(title, pno - 1) for level, title, pno in doc.get_toc() if level == 1 and 1 <= pno <= total_pages]
+                if not starts:
+                    raise ValueError("The document has no top-level bookmarks.")
+                starts.sort(key=lambda s: s[1])
+                if starts[0][1] > 0:
+                    starts.insert(0, ("front matter", 0))
+                bounds = [p for _, p in starts[1:]] + [total_pages]
+                parts = [(f"{base_name}_{k+1:02d}_{_safe_filename(title)}.pdf", list(range(first, end)))
+                         for k, ((title, first), end) in enumerate(zip(starts, bounds)) if end > first]
+            else:
+                raise ValueError(f"Unknown split mode '{mode}'.")
+
+            tasks = [(os.path.join(output_folder, name), indices) for name, indices in parts]
+            if len(tasks) == 1:
+                with open(tasks[0][0], "wb") as f, _StreamingPdfWriter(f) as writer:
+                    writer.copy_pages(pdf, tasks[0][1])
+                return [tasks[0][0]]
+
+        count = _worker_count(workers, len(tasks))
+        with ProcessPoolExecutor(max_workers=count, initializer=_open_pdf_worker_init, initargs=(input_path,)) as pool:
+            return list(pool.map(_split_worker, tasks, chunksize=max(1, len(tasks) // (count * 4))))
+
+    @staticmethod
+    def extract_images(pdf_path, output_dir, workers=None):
+        """
+        Feature 18: Extract raw images from PDF
+        Each image is written once, however many pages use it and however many
+        xrefs hold the same bytes. JPEG and JPEG 2000 streams are copied to disk
+        as they are; the rest are decoded and PNG-encoded on a process pool.
+        manifest.json maps every page to its image files. Existing files in
+        output_dir are never overwritten; new names get a numeric suffix.
+        """
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-            
-        count = 0
-        for i in range(len(doc)):
-            for img in doc.get_page_images(i):
-                xref = img[0]
-                pix = fitz.Pixmap(doc, xref)
-                # Convert CMYK to RGB if needed
-                if pix.n - pix.alpha > 3:
-                    pix = fitz.Pixmap(fitz.csRGB, pix)
-                
-                out_path = os.path.join(output_dir, f"page{i+1}_img{xref}.png")
-                pix.save(out_path)
-                count += 1
-        return f"Extracted {count} images."
-
-    @staticmethod
-    def flatten_pdf(pdf_path, output_path):
-        """Feature 19: Flatten forms and annotations"""
-        doc = fitz.open(pdf_path)
-        for page in doc:
-            # Merges widgets, forms, and annotations into the page content
-            page.flatten_annotations()
-            page.clean_contents() 
-        doc.save(output_path)
-
-    @staticmethod
-    def convert_grayscale(pdf_path, output_path):
-        """Feature 20: Convert to Grayscale"""
-        doc = fitz.open(pdf_path)
-        for page in doc:
-            # Render page to a grayscale pixmap
-            pix = page.get_pixmap(colorspace=fitz.csGRAY)
-            # Create a new PDF page from this pixmap (replacing the old one)
-            # Note: This rasterizes vector content (text becomes image). 
-            # For vector-preserving grayscale, we need Ghostscript, 
-            # but this is the Python-only way.
-            page.set_mediabox(page.rect)
-            page.clean_contents()
-            page.insert_image(page.rect, pixmap=pix)
-        doc.save(output_path)
+
+        files = {}         # xref -> file name
+        by_content = {}    # digest -> file name
+        images, pages = {}, {}  # file name -> manifest entry; page -> file names
+        decode = []        # (xref, smask, output path) for the pool
+        with fitz.open(pdf_path) as doc:
+            for pno in range(len(doc)):
+                names = pages.setdefault(str(pno + 1), [])
+                for xref, smask, width, height, bpc, colorspace, _, _, filter_, *_ in doc.get_page_images(pno):
+                    if xref not in files:
+                        raw = doc.xref_stream_raw(xref)
+                        digest = hashlib.sha256(raw)
+                        digest.update(repr((width, height, bpc, colorspace, filter_)).encode())
+                        if smask:
+                            digest.update(doc.xref_stream_raw(smask))
+                        digest = digest.hexdigest()
+                        if digest in by_content:
+                            files[xref] = by_content[digest]
+                        else:
+                            # Passthrough only when the stream alone is a complete image file
+                            ext = {"DCTDecode": "jpg", "JPXDecode": "jp2"}.get(filter_) if not smask else None
+                            name = _unused_name(output_dir, f"page{pno+1}_img{xref}.{ext or 'png'}")
+                            out_path = os.path.join(output_dir, name)
+                            if ext:
+                                with open(out_path, "wb") as f:
+                                    f.write(raw)
+                            else:
+                                decode.append((xref, smask, out_path))
+                            files[xref] = by_content[digest] = name
+                            images[name] = {"file": name, "xref": xref, "width": width, "height": height, "pages": []}
+                    name = files[xref]
+                    if name not in names:
+                        names.append(name)
+                        images[name]["pages"].append(pno + 1)
+
+        if decode:
+            batches = [decode[i:i + _EXTRACT_BATCH] for i in range(0, len(decode), _EXTRACT_BATCH)]
+            with ProcessPoolExecutor(max_workers=_worker_count(workers, len(batches))) as pool:
+                for future in [pool.submit(_extract_images_worker, pdf_path, batch) for batch in batches]:
+                    future.result()
+
+        with open(os.path.join(output_dir, _unused_name(output_dir, "manifest.json")), "w", encoding="utf-8") as f:
+            json.dump({"source": os.path.basename(pdf_path), "images": list(images.values()), "pages": pages}, f, indent=2)
+        return f"Extracted {len(images)} images."
+
+    @staticmethod
+    @_pdf_writer
+    def flatten_pdf(pdf_path, output_path, workers=None):
+        """
+        Feature 19: Flatten forms and annotations
+        Only pages that have annotations are touched; they are flattened in
+        parallel chunks and everything else is copied as is.
+        """
+        with pikepdf.open(pdf_path) as pdf:
+            with _transformed_pages(pdf, pdf_path, _pages_with_annotations(pdf), _fitz_flatten, workers):
+                # Every widget has been burned in, so the form itself is gone
+                if "/AcroForm" in pdf.Root:
+                    del pdf.Root["/AcroForm"]
+                pdf.save(output_path)
+
+    @staticmethod
+    @_pdf_writer
+    def convert_grayscale(pdf_path, output_path, dpi=72, mode="vector", workers=None):
+        """
+        Feature 20: Convert to Grayscale
+        mode="vector" rewrites colour operators, palettes, shadings and RGB/CMYK
+        images to gray, keeping text searchable and vector art sharp; pages and
+        images are converted in parallel. Resources inherited through the page
+        tree are followed and inline images are moved into image XObjects first.
+        Pattern, Separation and DeviceN colours are left as they are. mode="raster" stamps a gray rendering at `dpi`.
+        """
+        if mode == "raster":
+            doc = fitz.open(pdf_path)
+            # Render every page to grayscale on the shared render pool
+            requests = [RenderRequest(i, dpi, "gray", fmt="png") for i in range(len(doc))]
+            for page, res in zip(doc, RenderService.render(pdf_path, requests)):
+                # Create a new PDF page from this pixmap (replacing the old one)
+                # Note: This rasterizes vector content (text becomes image).
+                page.set_mediabox(page.rect)
+                page.clean_contents()
+                page.insert_image(page.rect, stream=res.data)
+            doc.save(output_path)
+            return
+        if mode != "vector":
+            raise ValueError(f"Unknown grayscale mode '{mode}'.")
+
+        with pikepdf.open(pdf_path) as pdf:
+            tasks = [("page", i) for i in range(len(pdf.pages))]
+            for page in pdf.pages:
+                _gray_resources(_page_resources(page.obj))
+                for annot in page.obj.get("/Annots", []):
+                    for key in ("/C", "/IC"):
+                        color = annot.get(key)
+                        if isinstance(color, pikepdf.Array) and len(color) in (3, 4):
+                            annot[key] = pikepdf.Array([_to_gray([float(v) for v in color], "rgb" if len(color) == 3 else "cmyk")])
+            for obj in pdf.objects:
+                if not isinstance(obj, pikepdf.Stream):
+                    continue
+                if obj.get("/Subtype") == "/Image":
+                    cs = obj.get("/ColorSpace")
+                    if isinstance(cs, pikepdf.Array) and len(cs) == 4 and cs[0] == "/Indexed":
+                        _gray_indexed(cs)
+                    elif _color_space_kind(cs) in ("rgb", "cmyk"):
+                        tasks.append(("image", obj.objgen))
+                elif obj.get("/Subtype") == "/Form" or obj.get("/PatternType") == 1:
+                    _gray_resources(obj.get("/Resources"))
+                    tasks.append(("form", obj.objgen))
+
+            with ProcessPoolExecutor(max_workers=_worker_count(workers, len(tasks)),
+                                     initializer=_open_pdf_worker_init, initargs=(pdf_path,)) as pool:
+                chunksize = max(1, len(tasks) // (_worker_count(workers, len(tasks)) * 4))
+                inline = []
+                for result in pool.map(_grayscale_worker, tasks, chunksize=chunksize):
+                    if result is None:
+                        continue
+                    (kind, key), data, filter_, has_inline = result
+                    if has_inline:
+                        inline.append((kind, key))
+                    if data is None:
+                        continue
+                    if kind == "page":
+                        pdf.pages[key].obj.Contents = pdf.make_stream(data)
+                    elif kind == "form":
+                        pdf.get_object(key).write(data)
+                    else:
+                        _set_gray_image(pdf.get_object(key), data, filter_)
+            for kind, key in inline:
+                _gray_inline_images(pdf.pages[key] if kind == "page" else pikepdf.Page(pdf.get_object(key)))
+            pdf.save(output_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
 
    # Inside the PDFEngine class, add this method:
     @staticmethod
+    @_pdf_writer
     def html_to_pdf(html_content, output_path):
         """
         Converts HTML to PDF using Headless Chromium (Playwright).
@@ -161,111 +2698,379 @@ class PDFEngine:
             raise e
 
     @staticmethod
+    @_pdf_writer
     def reorder_save_pdf(input_path, output_path, page_order_data):
-        reader = PdfReader(input_path)
-        writer = PdfWriter()
-        for item in page_order_data:
-            idx = item['original_index']
-            rotation = item.get('rotation', 0)
-            if 0 <= idx < len(reader.pages):
-                page = reader.pages[idx]
-                if rotation != 0:
-                    page.rotate(rotation)
-                writer.add_page(page)
-        with open(output_path, "wb") as f:
-            writer.write(f)
+        """
+        Applies a new page order and rotations by rewriting only the page tree
+        and /Rotate entries; content streams are copied as they are.
+        Pages left out are dropped; a page listed twice is copied, sharing its
+        content but with its own annotations, and rotated from its original angle.
+        When the order is unchanged only the rotations are appended, as an
+        incremental update.
+        """
+        with fitz.open(input_path) as doc:
+            total_pages = doc.page_count
+        if [item['original_index'] for item in page_order_data] == list(range(total_pages)):
+            def edit(doc):
+                for page, item in zip(doc, page_order_data):
+                    if item.get('rotation', 0):
+                        page.set_rotation((page.rotation + item['rotation']) % 360)
+            return _save_incremental(input_path, output_path, edit)
+
+        with pikepdf.open(input_path) as pdf:
+            sources = [page.obj for page in pdf.pages]
+            root = pdf.Root.Pages
+            # The tree is flattened below, so inherited attributes move onto the pages
+            for page in sources:
+                node = page.get("/Parent")
+                while node is not None:
+                    for key in _INHERITABLE_PAGE_KEYS:
+                        if key not in page and key in node:
+                            page[key] = node[key]
+                    node = node.get("/Parent")
+
+            # Duplicates are copied and every rotation computed from the
+            # untouched source, before any page is changed
+            rotations = [int(page.get("/Rotate", 0)) for page in sources]
+            kids, used = [], set()
+            for item in page_order_data:
+                idx = item['original_index']
+                if not 0 <= idx < len(sources):
+                    continue
+                kids.append((idx, _copy_page(pdf, sources[idx]) if idx in used else sources[idx],
+                             item.get('rotation', 0)))
+                used.add(idx)
+            for idx, page, turn in kids:
+                rotation = (rotations[idx] + turn) % 360
+                if rotation:
+                    page.Rotate = rotation
+                elif "/Rotate" in page:
+                    del page["/Rotate"]
+                page.Parent = root
+            kids = [page for _, page, _ in kids]
+            for idx, page in enumerate(sources):
+                if idx not in used and "/Parent" in page:
+                    # Dropped pages still linked from outlines must not pull the old tree in
+                    del page["/Parent"]
+
+            for key in _INHERITABLE_PAGE_KEYS:
+                if key in root:
+                    del root[key]
+            root.Kids = pikepdf.Array(kids)
+            root.Count = len(kids)
+            pdf.save(output_path, stream_decode_level=pikepdf.StreamDecodeLevel.none)
 
     @staticmethod
-    def images_to_pdf(image_list, output_path):
-        processed_images = []
-        temp_created = []
-        for img_path in image_list:
-            try:
-                img = Image.open(img_path)
-                if img.mode == 'RGBA' or img.format != 'JPEG':
-                    img = img.convert('RGB')
-                    temp_path = img_path + ".temp.jpg"
-                    img.save(temp_path, quality=95)
-                    processed_images.append(temp_path)
-                    temp_created.append(temp_path)
-                else:
-                    processed_images.append(img_path)
-            except Exception as e:
-                print(f"Error processing image {img_path}: {e}")
+    @_pdf_writer
+    def images_to_pdf(image_list, output_path, workers=None):
+        """
+        One page per image, sized by the image's DPI. image_list holds paths or
+        file bytes. JPEGs and plain PNGs are embedded as they are; anything else
+        (alpha, interlacing, other formats) is re-encoded losslessly in memory.
+        Images are prepared in parallel and written as they arrive.
+        """
+        def prepared(pool):
+            # Only a window of prepared images waits in memory
+            window = _worker_count(workers) * 2
+            pending = deque()
+            for source in image_list:
+                pending.append(pool.submit(_prepare_image, source))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
-        if processed_images:
-            with open(output_path, "wb") as f:
-                f.write(img2pdf.convert(processed_images))
-        
-        for temp in temp_created:
-            try: os.remove(temp)
-            except: pass
+        with contextlib.ExitStack() as stack:
+            if len(image_list) > 1:
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=_worker_count(workers, len(image_list))))
+                results = prepared(pool)
+            else:
+                results = map(_prepare_image, image_list)
+            writer = None
+            for i, (source, image) in enumerate(zip(image_list, results)):
+                if image is None:
+                    print(f"Error processing image {source if isinstance(source, str) else f'#{i + 1}'}")
+                    continue
+                if writer is None:
+                    writer = _StreamingPdfWriter(stack.enter_context(open(output_path, "wb")))
+                writer.add_image_page(image)
+            if writer is not None:
+                writer.close()
 
     @staticmethod
-    def pdf_to_images(input_path, output_folder, dpi=200, fmt="jpeg"):
-        images = convert_from_path(input_path, dpi=dpi)
+    def iter_pdf_images(input_path, output_folder, dpi=200, fmt="jpeg"):
+        """
+        Generator version of pdf_to_images: render workers encode and write each
+        page straight to disk, and only a small window of pages is in flight, so
+        peak memory stays flat no matter how long the document is. Yields each
+        output path in page order as soon as that page is on disk.
+        """
+        with fitz.open(input_path) as doc:
+            total = len(doc)
         base_name = os.path.splitext(os.path.basename(input_path))[0]
-        saved_files = []
-        for i, img in enumerate(images):
-            ext = fmt.lower()
-            out_file = os.path.join(output_folder, f"{base_name}_page_{i+1:03d}.{ext}")
-            img.save(out_file, fmt.upper())
-            saved_files.append(out_file)
-        return saved_files
+        ext = fmt.lower()
+        requests = (RenderRequest(i, dpi, fmt=fmt, out_file=os.path.join(output_folder, f"{base_name}_page_{i+1:03d}.{ext}"))
+                    for i in range(total))
+        for res in RenderService.render(input_path, requests, batch_size=1):
+            yield res.data
 
     @staticmethod
+    def pdf_to_images(input_path, output_folder, dpi=200, fmt="jpeg"):
+        return list(PDFEngine.iter_pdf_images(input_path, output_folder, dpi, fmt))
+
+    @staticmethod
+    @_pdf_writer
     def compress_pdf(input_path, output_path, level="medium"):
         if level == "low":
-            reader = PdfReader(input_path)
-            writer = PdfWriter()
-            for page in reader.pages:
-                page.compress_content_streams()
-                writer.add_page(page)
-            writer.add_metadata(reader.metadata)
-            with open(output_path, "wb") as f:
-                writer.write(f)
+            # Lossless and structure-preserving: deflate page content left uncompressed and
+            # drop unreachable objects, which is exactly what the analyzer's estimate counts
+            with pikepdf.open(input_path) as pdf:
+                for page in pdf.pages:
+                    contents = page.obj.get("/Contents")
+                    for c in (contents if isinstance(contents, pikepdf.Array) else [contents] if contents is not None else []):
+                        if "/Filter" not in c:
+                            c.write(c.read_bytes(), filter=pikepdf.Name.FlateDecode)
+                pdf.save(output_path, compress_streams=False, stream_decode_level=pikepdf.StreamDecodeLevel.none,
+                         object_stream_mode=pikepdf.ObjectStreamMode.generate)
         elif level == "medium":
             try:
-                with pikepdf.open(input_path) as pdf:
-                    pdf.save(output_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+                PDFEngine.optimize_pdf(input_path, output_path)
             except Exception as e:
-                raise Exception(f"Pikepdf failed: {e}")
+                raise Exception(f"Optimization failed: {e}")
         elif level == "extreme":
-            import tempfile, shutil
-            temp_dir = tempfile.mkdtemp()
-            try:
-                imgs = PDFEngine.pdf_to_images(input_path, temp_dir, dpi=130, fmt="jpeg")
-                with open(output_path, "wb") as f:
-                    f.write(img2pdf.convert(imgs))
-            finally:
-                shutil.rmtree(temp_dir)
+            PDFEngine.recompress_images(input_path, output_path)
+        elif level == "scanned":
+            PDFEngine.compress_scanned(input_path, output_path)
 
-    # --- NEW PRO FEATURES ---
+    @staticmethod
+    @_pdf_writer
+    def compress_scanned(input_path, output_path, quality=50, workers=None):
+        """
+        Re-encodes scanned page images by content: text as 1-bit G4, mixed pages
+        as MRC (G4 stencil over a 1/3-resolution JPEG), photos as JPEG.
+        """
+        with pikepdf.open(input_path) as pdf:
+            tasks = []
+            masks = _mask_objgens(pdf)
+            for obj in pdf.objects:
+                if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image" and _is_scan_candidate(obj, masks):
+                    tasks.append((obj.objgen, quality))
+
+            if tasks:
+                with ProcessPoolExecutor(max_workers=_worker_count(workers, len(tasks)),
+                                         initializer=_open_pdf_worker_init, initargs=(input_path,)) as pool:
+                    for result in pool.map(_scan_compress_worker, tasks):
+                        if result is None:
+                            continue
+                        objgen, kind, w, h, g4, jpeg, bg_size, fill, gray = result
+                        obj = pdf.get_object(objgen)
+                        if kind == "photo":
+                            _replace_with_jpeg(obj, jpeg, w, h, gray)
+                        elif kind == "text":
+                            obj.write(g4, filter=pikepdf.Name.CCITTFaxDecode, decode_parms=_g4_params(w, h))
+                            obj.ColorSpace, obj.BitsPerComponent = pikepdf.Name.DeviceGray, 1
+                        else:
+                            _replace_with_mrc(pdf, obj, w, h, g4, jpeg, bg_size, fill)
+            pdf.save(output_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+    @staticmethod
+    @_pdf_writer
+    def optimize_pdf(input_path, output_path, subset_fonts=True):
+        """
+        Lossless clean-up: drops resources no page draws, subsets embedded fonts to
+        the glyphs used and merges identical objects, such as the font copies that
+        merging and watermarking leave behind.
+        """
+        with pikepdf.open(input_path) as pdf:
+            _save_optimized(pdf, output_path, subset_fonts)
+
+    @staticmethod
+    def analyze_pdf(input_path, sample_size=_ANALYSIS_SAMPLE):
+        """
+        Reports where the bytes of a PDF are and estimates the output size of each
+        compress_pdf level. Returns {"file_size", "pages", "objects", "categories":
+        {name: bytes}, "estimates": {level: bytes}, "sampled_images"}.
+        """
+        with pikepdf.open(input_path) as pdf:
+            model = _SizeModel(pdf, os.path.getsize(input_path), sample_size)
+            deadline = time.monotonic() + _ANALYSIS_BUDGET
+            return {
+                "file_size": model.file_size,
+                "pages": len(pdf.pages),
+                "objects": model.objects,
+                "categories": dict(sorted(model.categories.items(), key=lambda kv: -kv[1])),
+                "estimates": {
+                    "low": int(model.predict_low()),
+                    "medium": int(model.predict_medium()),
+                    "extreme": int(model.predict_jpeg(110, 55, deadline)),
+                    "scanned": int(model.predict_scanned(50, deadline)),
+                },
+                "sampled_images": len(model.jpeg_sample) + len(model.scan_sample),
+            }
 
     @staticmethod
-    def ocr_pdf(input_path, output_path, lang='eng'):
-        """Converts PDF to images, then uses Tesseract to create a searchable PDF."""
+    @_pdf_writer
+    def compress_to_size(input_path, output_path, target_bytes, workers=None):
+        """
+        Runs the lossless "medium" pass and, if that is not small enough, picks the
+        gentlest image dpi/quality predicted (from a sample of its images) to land
+        under target_bytes, then encodes once more. Returns {"dpi", "quality",
+        "predicted", "size"}; dpi/quality are None when the lossless pass fits.
+        Raises, leaving output_path untouched, when even the last step misses the target.
+        """
+        fd, medium = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
         try:
-            # 1. Convert pages to images
-            images = convert_from_path(input_path)
-            writer = PdfWriter()
+            # Measured, not predicted: what subsetting and merging save varies too much to model well
+            PDFEngine.compress_pdf(input_path, medium, "medium")
+            choice, predicted = (None, None), os.path.getsize(medium)
+            if predicted > target_bytes:
+                with pikepdf.open(medium) as pdf:
+                    model = _SizeModel(pdf, predicted, sample_size=6)
+                    limit = target_bytes * _TARGET_MARGIN
+                    for dpi, quality in (_TARGET_STEPS if model.jpeg_candidates else []):
+                        choice, predicted = (dpi, quality), model.predict_jpeg(dpi, quality)
+                        if predicted <= limit:
+                            break
 
-            # 2. OCR each image and get a single-page PDF byte stream
-            for i, img in enumerate(images):
-                pdf_bytes = pytesseract.image_to_pdf_or_hocr(img, extension='pdf', lang=lang)
-                
-                # 3. Read that byte stream as a PDF page and add to writer
-                page_reader = PdfReader(io.BytesIO(pdf_bytes))
-                writer.add_page(page_reader.pages[0])
+            dpi, quality = choice
+            result = medium
+            if dpi is not None:
+                result = medium[:-4] + "_lossy.pdf"
+                PDFEngine.recompress_images(medium, result, dpi, quality, workers)
+            size = os.path.getsize(result)
+            # Only a result under the target reaches output_path, so a failure leaves nothing behind
+            if size > target_bytes:
+                raise Exception(f"Could only reach {size / 1048576:.1f} MB (target {target_bytes / 1048576:.1f} MB).")
+            shutil.move(result, output_path)
+        finally:
+            for path in (medium, medium[:-4] + "_lossy.pdf"):
+                if os.path.exists(path):
+                    os.remove(path)
+        return {"dpi": dpi, "quality": quality, "predicted": int(predicted), "size": size}
+
+    @staticmethod
+    @_pdf_writer
+    def recompress_images(input_path, output_path, dpi=110, quality=55, workers=None):
+        """
+        Downsamples embedded images to `dpi` at the size they are drawn, and
+        re-encodes them as JPEG at `quality`, then runs the optimize_pdf pass.
+        Text and vector content are otherwise untouched.
+        """
+        with pikepdf.open(input_path) as pdf:
+            sizes = _image_display_sizes(pdf)
+            tasks = []
+            for obj in pdf.objects:
+                if not isinstance(obj, pikepdf.Stream) or obj.get("/Subtype") != "/Image":
+                    continue
+                drawn = sizes.get(obj.objgen[0])
+                # Images never drawn on a page have no known size, so leave them alone
+                if drawn is None or not _is_jpeg_candidate(obj):
+                    continue
+                tasks.append((obj.objgen, *_downsample_size(obj, drawn, dpi), quality))
+
+            if tasks:
+                with ProcessPoolExecutor(max_workers=_worker_count(workers, len(tasks)),
+                                         initializer=_open_pdf_worker_init, initargs=(input_path,)) as pool:
+                    for result in pool.map(_recompress_image_worker, tasks, chunksize=4):
+                        if result is None:
+                            continue
+                        objgen, jpeg, w, h, gray, smask_data = result
+                        obj = pdf.get_object(objgen)
+                        _replace_with_jpeg(obj, jpeg, w, h, gray)
+                        if smask_data is not None:
+                            smask = obj.SMask
+                            smask.write(smask_data, filter=pikepdf.Name.FlateDecode)
+                            smask.Width, smask.Height, smask.BitsPerComponent = w, h, 8
+                            for key in ("/DecodeParms", "/Decode"):
+                                if key in smask:
+                                    del smask[key]
+            # The lossless "medium" pass too, so the lossy levels keep its savings
+            _save_optimized(pdf, output_path)
 
-            with open(output_path, "wb") as f:
-                writer.write(f)
+    # --- NEW PRO FEATURES ---
+
+    @staticmethod
+    @_pdf_writer
+    def ocr_pdf(input_path, output_path, lang='eng', dpi=200, workers=None, use_cache=True, mode="replace",
+                preprocess=False, resume=True):
+        """
+        Converts PDF to images, then uses Tesseract to create a searchable PDF.
+        Pages are fanned out over the shared OCRWorkerPool (workers=None uses every
+        core). Workers keep the language model loaded between tasks, so only the small per-page results travel back to the main process.
+        With use_cache, pages whose rendered pixels were OCRed before are reused.
+
+        mode="replace": every page becomes tesseract's image + text page.
+        mode="overlay": only pages without extractable text are OCRed, and their
+        words are added as an invisible layer on the original page objects.
+        preprocess=True runs the deskew/rotate/binarize/crop clean-up in the workers first.
+        Each finished page is checkpointed, so with resume a crashed or cancelled
+        run continues where it stopped; pages are merged in order at the end.
+        """
+        try:
+            with fitz.open(input_path) as doc:
+                if mode == "overlay":
+                    # Born-digital pages already have a text layer; leave them untouched
+                    pages = [i for i, page in enumerate(doc) if not page.get_text("text").strip()]
+                else:
+                    pages = list(range(len(doc)))
+            kind = "words" if mode == "overlay" else "pdf"
+            checkpoint = JobCheckpoint("ocr", input_path, [lang, dpi, mode, preprocess])
+            if not resume:
+                checkpoint.finish()
+                checkpoint = JobCheckpoint("ocr", input_path, [lang, dpi, mode, preprocess])
+            todo = [i for i in pages if not checkpoint.done(i)]
+            if todo:
+                pool = OCRWorkerPool.get(lang, workers)
+                cache = OCRCache() if use_cache else None
+                try:
+                    futures = {pool.submit(_ocr_page_worker, (input_path, i, dpi, cache.cache_dir if cache else None,
+                                                              kind, preprocess)): i for i in todo}
+                    # Persist each page the moment it finishes, whatever order they complete in
+                    for future in as_completed(futures):
+                        checkpoint.save(futures[future], future.result())
+                except BrokenProcessPool:
+                    OCRWorkerPool.discard(lang, workers)
+                    raise Exception("An OCR worker process crashed. Please try again.")
+                if cache:
+                    cache.evict()
+
+            if mode == "overlay":
+                with fitz.open(input_path) as doc:
+                    font = _add_glyphless_font(doc)
+                    for i in pages:
+                        _insert_invisible_words(doc[i], json.loads(checkpoint.load(i)), font=font)
+                    doc.save(output_path, garbage=3, deflate=True)
+            else:
+                writer = PdfWriter()
+                for i in pages:
+                    page_reader = PdfReader(checkpoint.path(i))
+                    writer.add_page(page_reader.pages[0])
+                with open(output_path, "wb") as f:
+                    writer.write(f)
+            checkpoint.finish()
         except Exception as e:
             if "tesseract" in str(e).lower():
                 raise Exception("Tesseract OCR not found. Please install Tesseract and add it to PATH.")
             raise e
 
     @staticmethod
+    @_pdf_writer
+    def clean_scan(input_path, output_path, dpi=300, rotate=True, deskew=True, binarize=True, crop=True):
+        """Auto-rotates, deskews, binarizes and crops scanned pages on the shared render pool."""
+        options = {'rotate': rotate, 'deskew': deskew, 'binarize': binarize, 'crop': crop}
+        with fitz.open(input_path) as doc:
+            total = len(doc)
+        out = fitz.open()
+        if total:
+            tasks = [(input_path, i, dpi, options) for i in range(total)]
+            for png, w, h in RenderService.pool().map(_clean_scan_worker, tasks):
+                page = out.new_page(width=w * 72.0 / dpi, height=h * 72.0 / dpi)
+                page.insert_image(page.rect, stream=png)
+        out.save(output_path, garbage=3, deflate=True)
+
+    @staticmethod
+    @_pdf_writer
     def add_watermark(input_path, output_path, text="", opacity=0.5, rotation=45):
         """Adds a text watermark to every page."""
         reader = PdfReader(input_path)
@@ -299,6 +3104,7 @@ class PDFEngine:
             writer.write(f)
 
     @staticmethod
+    @_pdf_writer
     def add_page_numbers(input_path, output_path, position="bottom-center"):
         """Adds Page X of Y."""
         reader = PdfReader(input_path)
@@ -335,13 +3141,37 @@ class PDFEngine:
         return reader.metadata
 
     @staticmethod
+    @_pdf_writer
     def update_metadata(input_path, output_path, metadata):
-        reader = PdfReader(input_path)
-        writer = PdfWriter()
-        writer.append_pages_from_reader(reader)
-        writer.add_metadata(metadata)
-        with open(output_path, "wb") as f:
-            writer.write(f)
+        """
+        metadata uses Info keys ("/Title", ...); other existing entries are kept and
+        empty values clear theirs. Edits are appended as an incremental update,
+        unless an entry the file has is being cleared: that rewrites the file
+        (see _rewrite_metadata), so no earlier revision still holds the value.
+        """
+        with pikepdf.open(input_path) as pdf:
+            info = pdf.trailer.get("/Info")
+            present = {k for k, v in info.items() if str(v)} if info is not None else set()
+        if any(not value and key in present for key, value in metadata.items()):
+            _rewrite_metadata(input_path, output_path, metadata)
+            return
+
+        def edit(doc):
+            # Only the values being set: empty ones would be written as null
+            changes = {}
+            for key, value in metadata.items():
+                if value:
+                    name = key.lstrip("/")
+                    changes[name[:1].lower() + name[1:]] = value
+            if changes:
+                doc.set_metadata(changes)
+        _save_incremental(input_path, output_path, edit)
+
+    @staticmethod
+    @_pdf_writer
+    def clear_metadata(input_path, output_path):
+        """Removes the document info and XMP metadata, rewriting the whole file."""
+        _rewrite_metadata(input_path, output_path)
 
     @staticmethod
     def auto_scan_image(image_path):
@@ -349,148 +3179,101 @@ class PDFEngine:
         Robustly detects document contours using adaptive thresholding
         to handle noisy backgrounds (like patterned fabrics).
         """
-        import cv2
-        import numpy as np
-        from PIL import Image
-
         img = cv2.imread(image_path)
-        orig = img.copy()
-        
-        # 1. Resize for faster processing (maintain aspect ratio)
-        scale_height = 800.0
-        ratio = img.shape[0] / scale_height
-        w = int(img.shape[1] / ratio)
-        img_small = cv2.resize(img, (w, int(scale_height)))
-
-        # 2. Preprocessing (Grayscale + Blur)
-        gray = cv2.cvtColor(img_small, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (5, 5), 0)
-
-        # 3. Edge Detection (Canny) AND Adaptive Thresholding
-        # We combine both to find strong edges of the paper
-        edged = cv2.Canny(gray, 75, 200)
-        
-        # Morphological closing to close small gaps in the contour
-        kernel = np.ones((5, 5), np.uint8)
-        edged = cv2.morphologyEx(edged, cv2.MORPH_CLOSE, kernel)
-
-        # 4. Find Contours
-        cnts, _ = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:5]
-
-        screenCnt = None
-        for c in cnts:
-            peri = cv2.arcLength(c, True)
-            approx = cv2.approxPolyDP(c, 0.02 * peri, True)
-
-            # If our approximated contour has 4 points, we can assume we found the screen
-            if len(approx) == 4:
-                screenCnt = approx
-                break
-
+        corners = _detect_document_corners(img)
         # If detection failed, return original
-        if screenCnt is None:
+        if corners is None:
             print("Smart Scan: No document contour detected, returning original.")
-            return Image.fromarray(cv2.cvtColor(orig, cv2.COLOR_BGR2RGB))
+            return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        return Image.fromarray(cv2.cvtColor(_warp_document(img, corners), cv2.COLOR_BGR2RGB))
 
-        # 5. Perspective Transform
-        pts = screenCnt.reshape(4, 2) * ratio
-        
-        # Order points: top-left, top-right, bottom-right, bottom-left
-        rect = np.zeros((4, 2), dtype="float32")
-        s = pts.sum(axis=1)
-        rect[0] = pts[np.argmin(s)] # TL
-        rect[2] = pts[np.argmax(s)] # BR
-        diff = np.diff(pts, axis=1)
-        rect[1] = pts[np.argmin(diff)] # TR
-        rect[3] = pts[np.argmax(diff)] # BL
-
-        (tl, tr, br, bl) = rect
-        
-        # Compute new width/height
-        widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
-        widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
-        maxWidth = max(int(widthA), int(widthB))
-
-        heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
-        heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
-        maxHeight = max(int(heightA), int(heightB))
-
-        dst = np.array([
-            [0, 0],
-            [maxWidth - 1, 0],
-            [maxWidth - 1, maxHeight - 1],
-            [0, maxHeight - 1]], dtype="float32")
-
-        # Warp
-        M = cv2.getPerspectiveTransform(rect, dst)
-        warp = cv2.warpPerspective(orig, M, (maxWidth, maxHeight))
-        
-        # Optional: Adaptive Threshold to make it look like a "scanned" B&W doc
-        # For now, we return color as users might want color scans.
-        # To make it B&W like a scanner, uncomment the next line:
-        # warp = cv2.cvtColor(warp, cv2.COLOR_BGR2GRAY)
+    @staticmethod
+    def batch_auto_scan(image_paths, out_dir, workers=None, quality=92):
+        """
+        Smart Scan for many photos at once, on a process pool. Returns one dict
+        per input, in order: {"source", "image": path of the warped JPEG in
+        out_dir, "corners", "flagged"}. Workers write the JPEGs themselves, so
+        memory does not grow with the number of photos. Flagged photos had no
+        4-point contour; their image is None and they need manual corners
+        (manual_scan_warp).
+        """
+        tasks = [(path, quality, out_dir) for path in image_paths]
+        if len(tasks) <= 1:
+            results = [_batch_scan_worker(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=_worker_count(workers, len(tasks))) as pool:
+                results = list(pool.map(_batch_scan_worker, tasks))
+        return [{"source": path, "image": image, "corners": corners, "flagged": image is None}
+                for path, (image, corners) in zip(image_paths, results)]
 
-        return Image.fromarray(cv2.cvtColor(warp, cv2.COLOR_BGR2RGB))
+    @staticmethod
+    def prepare_scan(image_path):
+        """
+        Decodes a photo once and looks for the document in it. Returns (BGR image,
+        corners as [[x, y]] * 4 or None); pass the image to manual_scan_warp to
+        skip decoding it again.
+        """
+        img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        corners = _detect_document_corners(img) if img is not None else None
+        return img, None if corners is None else corners.tolist()
 
     @staticmethod
-    def manual_scan_warp(image_path, corners):
+    def manual_scan_warp(image_path, corners, image=None):
         """
         Warps image based on 4 manual corner points.
         corners: list of 4 tuples [(x,y), (x,y), (x,y), (x,y)]
+        image: the photo already decoded by prepare_scan, if at hand
         """
-        import cv2
-        import numpy as np
-        from PIL import Image
-
-        img = cv2.imread(image_path)
-        orig = img.copy()
-        
-        # Helper to order points: TL, TR, BR, BL
-        pts = np.array(corners, dtype="float32")
-        rect = np.zeros((4, 2), dtype="float32")
-        
-        s = pts.sum(axis=1)
-        rect[0] = pts[np.argmin(s)] # TL
-        rect[2] = pts[np.argmax(s)] # BR
-        diff = np.diff(pts, axis=1)
-        rect[1] = pts[np.argmin(diff)] # TR
-        rect[3] = pts[np.argmax(diff)] # BL
-
-        (tl, tr, br, bl) = rect
-
-        # Compute width/height
-        widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
-        widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
-        maxWidth = max(int(widthA), int(widthB))
-
-        heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
-        heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
-        maxHeight = max(int(heightA), int(heightB))
-
-        dst = np.array([
-            [0, 0],
-            [maxWidth - 1, 0],
-            [maxWidth - 1, maxHeight - 1],
-            [0, maxHeight - 1]], dtype="float32")
-
-        M = cv2.getPerspectiveTransform(rect, dst)
-        warp = cv2.warpPerspective(orig, M, (maxWidth, maxHeight))
-        
+        img = image if image is not None else cv2.imread(image_path)
+        warp = _warp_document(img, _order_corners(np.array(corners, dtype="float32")))
         return Image.fromarray(cv2.cvtColor(warp, cv2.COLOR_BGR2RGB))
     
     # --- EXISTING CONVERSIONS ---
     @staticmethod
-    def pdf_to_word(input_path, output_path):
+    def pdf_to_word(input_path, output_path, resume=True, chunk_pages=10):
+        """
+        Parses pages in chunks and checkpoints each page's layout (pdf2docx's own
+        store/restore format), so an interrupted conversion resumes from the last
+        finished page. The docx is built from all checkpoints at the end.
+        """
+        checkpoint = JobCheckpoint("word", input_path)
+        if not resume:
+            checkpoint.finish()
+            checkpoint = JobCheckpoint("word", input_path)
         cv = Converter(input_path)
-        cv.convert(output_path, start=0, end=None)
-        cv.close()
+        try:
+            settings = cv.default_settings
+            cv.load_pages()
+            total = len(cv.pages)
+            todo = [i for i in range(total) if not checkpoint.done(i, "json")]
+            for start in range(0, len(todo), chunk_pages):
+                chunk = todo[start:start + chunk_pages]
+                for page in cv.pages:
+                    page.skip_parsing = True
+                for i in chunk:
+                    cv.pages[i].skip_parsing = False
+                # Same per-segment analysis pdf2docx uses for its multi-processing mode
+                cv.parse_document(**settings).parse_pages(**settings)
+                for i in chunk:
+                    page = cv.pages[i]
+                    # Pages pdf2docx gave up on are recorded as empty so a resume does not retry them forever
+                    data = page.store() if page.finalized else {}
+                    checkpoint.save(i, json.dumps(data).encode("utf-8"), "json")
+
+            stored = [json.loads(checkpoint.load(i, "json")) for i in range(total)]
+            cv.restore({'page_cnt': total, 'pages': [p for p in stored if p]})
+            cv.make_docx(output_path, **settings)
+        finally:
+            cv.close()
+        checkpoint.finish()
 
     @staticmethod
+    @_pdf_writer
     def word_to_pdf(input_path, output_path):
         docx_convert(input_path, output_path)
 
     @staticmethod
+    @_pdf_writer
     def pptx_to_pdf(input_path, output_path):
         powerpoint = comtypes.client.CreateObject("Powerpoint.Application")
         powerpoint.Visible = 1 
@@ -505,22 +3288,18 @@ class PDFEngine:
 
     @staticmethod
     def pdf_to_pptx(input_path, output_path):
-        temp_dir = os.path.dirname(output_path)
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        images = convert_from_path(input_path, dpi=150)
+        with fitz.open(input_path) as doc:
+            total = len(doc)
         prs = Presentation()
         blank_slide_layout = prs.slide_layouts[6] 
-        if images:
-            width, height = images[0].size
-            prs.slide_width = int(width * 9525) 
-            prs.slide_height = int(height * 9525)
-        for i, img in enumerate(images):
-            temp_img_path = os.path.join(temp_dir, f"{base_name}_temp_slide_{i}.jpg")
-            img.save(temp_img_path, 'JPEG')
+        # Slides are JPEG-encoded by the render workers and added straight from memory
+        requests = [RenderRequest(i, 150, fmt="jpeg") for i in range(total)]
+        for i, res in enumerate(RenderService.render(input_path, requests)):
+            if i == 0:
+                prs.slide_width = int(res.width * 9525) 
+                prs.slide_height = int(res.height * 9525)
             slide = prs.slides.add_slide(blank_slide_layout)
-            slide.shapes.add_picture(temp_img_path, 0, 0, prs.slide_width, prs.slide_height)
-            try: os.remove(temp_img_path)
-            except: pass
+            slide.shapes.add_picture(io.BytesIO(res.data), 0, 0, prs.slide_width, prs.slide_height)
         prs.save(output_path)
 
     @staticmethod
@@ -533,6 +3312,7 @@ class PDFEngine:
             writer.write(f)
 
     @staticmethod
+    @_pdf_writer
     def unlock_pdf(input_path, output_path, password):
         reader = PdfReader(input_path)
         if reader.is_encrypted: